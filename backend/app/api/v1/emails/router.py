@@ -1,40 +1,71 @@
-from fastapi import APIRouter
-from app.services.email_service import EmailService
+from fastapi import APIRouter, Depends, Request
+from app.services.registry import ServiceRegistry
+from app.scheduler.jobs.email_polling_job import execute_email_polling_job
 from app.core import settings
 import os
 from datetime import datetime, timedelta
 from typing import Optional
 
 router = APIRouter()
-email_service = EmailService()
+
+
+def get_services(request: Request) -> ServiceRegistry:
+    """lifespanで生成した共有サービスを取得"""
+    return request.app.state.services
+
 
 @router.get("/status")
-async def get_email_status():
-    """メールポーリングの状態を取得"""
-    return {"status": "running", "message": "Email polling system is active"}
+async def get_email_status(services: ServiceRegistry = Depends(get_services)):
+    """メールポーリングの状態と接続の利用状況を取得"""
+    return {
+        "status": "running",
+        "message": "Email polling system is active",
+        "notion_clients": services.notion_service.get_snapshot_info(),
+        "dify_calls": services.dify_service.get_call_stats(),
+        "work_queue": services.email_service.work_queue.get_stats(),
+        "rate_limits": {
+            "notion": services.notion_service.get_rate_limit_stats()
+        },
+        "concurrency": {
+            "dify_workflow": services.dify_service.get_concurrency_stats()
+        },
+        "hedging": {
+            "dify_ocr": services.dify_service.get_hedge_stats()
+        },
+        "circuit_breakers": {
+            "x_api": services.x_api_service.get_circuit_breaker_stats(),
+            "dify": services.dify_service.get_circuit_breaker_stats(),
+            "notion": services.notion_service.get_circuit_breaker_stats()
+        },
+        "connections": {
+            "imap": services.imap_pool.get_stats(),
+            "x_api": services.x_api_service.get_connection_stats(),
+            "dify": services.dify_service.get_connection_stats()
+        }
+    }
 
 @router.post("/poll")
-async def manual_poll_emails():
-    """手動でメールポーリングを実行"""
-    result = await email_service.poll_emails()
+async def manual_poll_emails(services: ServiceRegistry = Depends(get_services)):
+    """手動でメールポーリングを実行（ジョブが実行中の場合は完了後にもう一度実行し、その結果を返す）"""
+    result = await execute_email_polling_job(services)
     return {"message": "Email polling completed", "result": result}
 
 @router.get("/latest")
-async def get_latest_emails():
+async def get_latest_emails(services: ServiceRegistry = Depends(get_services)):
     """最新のメール一覧を取得"""
-    emails = await email_service.get_latest_emails()
+    emails = await services.email_service.get_latest_emails()
     return {"emails": emails}
 
 @router.get("/processed-ids")
-async def get_processed_ids():
+async def get_processed_ids(services: ServiceRegistry = Depends(get_services)):
     """処理済みメールID情報を取得"""
-    info = await email_service.get_processed_ids_info()
+    info = await services.email_service.get_processed_ids_info()
     return info
 
 @router.delete("/processed-ids")
-async def clear_processed_ids():
+async def clear_processed_ids(services: ServiceRegistry = Depends(get_services)):
     """処理済みメールIDをクリア（管理用）"""
-    result = await email_service.clear_processed_ids()
+    result = await services.email_service.clear_processed_ids()
     return result
 
 @router.delete("/storage/cleanup")
@@ -95,7 +126,7 @@ async def cleanup_storage(days_old: Optional[int] = 7):
         return {"error": f"ストレージクリーンアップエラー: {str(e)}"}
 
 @router.get("/storage/stats")
-async def get_storage_stats():
+async def get_storage_stats(services: ServiceRegistry = Depends(get_services)):
     """ストレージの統計情報を取得"""
     try:
         stats = {
@@ -132,6 +163,12 @@ async def get_storage_stats():
         stats["pdfs"]["total_size_mb"] = round(stats["pdfs"]["total_size"] / (1024 * 1024), 2)
         stats["total_size_mb"] = round((stats["emails"]["total_size"] + stats["pdfs"]["total_size"]) / (1024 * 1024), 2)
         
+        # OCR結果キャッシュの統計（ヒット率を含む）
+        stats["ocr_cache"] = services.ocr_cache.get_stats()
+        
+        # 外部API処理の進捗（段階ごとの件数・失敗中の件数）
+        stats["work_queue"] = services.email_service.work_queue.get_stats()
+        
         return stats
         
     except Exception as e:
@@ -0,0 +1,95 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Any, AsyncIterator
+
+
+class LimiterSlot:
+    """実行枠を使っている間に、応答から得た過負荷の兆候を記録する"""
+
+    def __init__(self):
+        self.overloaded = False
+        self.cancelled = False
+
+    def mark_overloaded(self):
+        """5xxなど、相手側の過負荷を示す応答を受け取った"""
+        self.overloaded = True
+
+
+class AdaptiveLimiter:
+    """AIMD（加算増加・乗算減少）で同時実行数の上限を調整するリミッター
+
+    - 上限まで使い切った状態で応答時間が目標以内に収まれば、上限を少しずつ増やす（1窓あたり+1）
+    - タイムアウトや5xxを受けたら上限を decrease_factor 倍に減らす（同じ混雑による連続した減少は1回にまとめる）
+    - 上限は min_limit から max_limit の範囲に収める
+    """
+
+    def __init__(self, min_limit: int, max_limit: int, initial_limit: int, decrease_factor: float = 0.5):
+        self.min_limit = max(min_limit, 1)
+        self.max_limit = max(max_limit, self.min_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.decrease_factor = decrease_factor
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+        self._stats = {
+            "increases": 0,
+            "decreases": 0,
+            "overloads": 0
+        }
+
+    @asynccontextmanager
+    async def slot(self, target_latency: float) -> AsyncIterator[LimiterSlot]:
+        """実行枠を確保して処理を行う（枠が空くまで待機）"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < int(self.limit))
+            self._in_flight += 1
+            saturated = self._in_flight >= int(self.limit)
+
+        slot = LimiterSlot()
+        started = time.monotonic()
+        try:
+            yield slot
+        except asyncio.TimeoutError:
+            slot.mark_overloaded()
+            raise
+        except asyncio.CancelledError:
+            # ヘッジで不要になった呼び出しなど。応答時間の判断材料にしない
+            slot.cancelled = True
+            raise
+        finally:
+            await self._release(slot, started, time.monotonic() - started, target_latency, saturated)
+
+    async def _release(self, slot: LimiterSlot, started: float, latency: float, target_latency: float, saturated: bool):
+        async with self._condition:
+            self._in_flight -= 1
+            if slot.cancelled:
+                pass
+            elif slot.overloaded:
+                self._stats["overloads"] += 1
+                # 前回の減少より後に始まった呼び出しの失敗のみで減らす
+                if started >= self._last_decrease:
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self._last_decrease = time.monotonic()
+                    self._stats["decreases"] += 1
+            elif saturated and latency <= target_latency and self.limit < self.max_limit:
+                previous = int(self.limit)
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                if int(self.limit) > previous:
+                    self._stats["increases"] += 1
+            self._condition.notify_all()
+
+    def has_capacity(self) -> bool:
+        """待たずに実行できる枠が空いているか"""
+        return self._in_flight < int(self.limit)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """現在の上限（窓）と実行中の数を取得"""
+        return {
+            "limit": int(self.limit),
+            "limit_exact": round(self.limit, 3),
+            "in_flight": self._in_flight,
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            **self._stats
+        }
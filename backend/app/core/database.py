@@ -0,0 +1,15 @@
+import os
+import sqlite3
+
+
+def connect_sqlite(db_path: str) -> sqlite3.Connection:
+    """ローカル状態保存用のSQLite接続を作成
+
+    WALモードで開き、書き込み中にプロセスが落ちてもDBが壊れないようにする。
+    接続はスレッド間で共有されるため、呼び出し側でロックを取ること。
+    """
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=FULL")
+    return conn
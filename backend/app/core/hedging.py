@@ -0,0 +1,139 @@
+import asyncio
+import math
+from collections import deque
+from typing import Dict, Any, Awaitable, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class LatencyTracker:
+    """直近の成功した呼び出しの応答時間（秒）を保持し、パーセンタイルを求める"""
+
+    def __init__(self, window: int):
+        self._samples = deque(maxlen=max(window, 1))
+
+    def record(self, latency: float):
+        self._samples.append(latency)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        rank = min(max(math.ceil(percent / 100 * len(ordered)) - 1, 0), len(ordered) - 1)
+        return ordered[rank]
+
+
+class Hedger:
+    """応答が遅い呼び出しに重複リクエスト（ヘッジ）を送り、先に成功した結果を使う
+
+    - 最初の呼び出しがリクエストを送信してから、直近の応答時間の percentile パーセンタイルを過ぎても返らなければ、
+      同じ呼び出しをもう1つ送る（同時実行数の枠を待っている間は送信前とみなし、ヘッジしない）
+    - 先に成功した方の結果を返し、もう一方はキャンセルする（一方が失敗した場合はもう一方の結果を待つ）
+    - ヘッジの数は呼び出し全体の budget_percent % まで。応答時間が min_samples 件たまるまではヘッジしない
+    - has_capacity が False を返す間（相手が混雑している間）はヘッジしない
+    - 応答時間は呼び出し側がリクエストの送信から応答までを record() で記録する（再試行の待機や枠待ちを含めない）。
+      enabled=False でも記録する（有効にする前にパーセンタイルを確認できる）
+    """
+
+    def __init__(
+        self,
+        name: str,
+        enabled: bool,
+        percentile: float,
+        budget_percent: float,
+        min_samples: int,
+        window: int,
+        has_capacity: Callable[[], bool] = lambda: True
+    ):
+        self.name = name
+        self.enabled = enabled
+        self.percentile = percentile
+        self.budget_percent = budget_percent
+        self.min_samples = min_samples
+        self.has_capacity = has_capacity
+        self.latencies = LatencyTracker(window)
+        self._stats = {
+            "requests": 0,
+            "hedged": 0,
+            "hedge_wins": 0,
+            "budget_exhausted": 0,
+            "skipped_busy": 0
+        }
+
+    def record(self, latency: float):
+        """成功したリクエストの応答時間（秒）を記録"""
+        self.latencies.record(latency)
+
+    def _hedge_delay(self) -> Optional[float]:
+        if not self.enabled or len(self.latencies) < self.min_samples:
+            return None
+        return self.latencies.percentile(self.percentile)
+
+    def _within_budget(self) -> bool:
+        return self._stats["hedged"] + 1 <= self._stats["requests"] * self.budget_percent / 100
+
+    async def run(self, call: Callable[[asyncio.Event], Awaitable[T]]) -> T:
+        """call(started) を実行し、必要に応じてヘッジする
+
+        call は呼ぶたびに新しいリクエストを送り、実際に送信を始める時点で started をセットすること
+        """
+        self._stats["requests"] += 1
+        started = asyncio.Event()
+        primary = asyncio.create_task(call(started))
+        delay = self._hedge_delay()
+        if delay is None:
+            return await primary
+
+        hedge = None
+        started_waiter = asyncio.create_task(started.wait())
+        try:
+            # 送信を始めるまで（同時実行数の枠待ちの間）は計測しない
+            await asyncio.wait({primary, started_waiter}, return_when=asyncio.FIRST_COMPLETED)
+            if not primary.done():
+                await asyncio.wait({primary}, timeout=delay)
+            if primary.done():
+                return primary.result()
+            if not self._within_budget():
+                self._stats["budget_exhausted"] += 1
+                return await primary
+            if not self.has_capacity():
+                self._stats["skipped_busy"] += 1
+                return await primary
+
+            self._stats["hedged"] += 1
+            print(f"{self.name} の応答が{delay:.1f}秒（p{self.percentile:g}）を過ぎたため、重複リクエストを送信します")
+            hedge = asyncio.create_task(call(asyncio.Event()))
+            pending = {primary, hedge}
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                succeeded = [task for task in done if task.exception() is None]
+                if succeeded or not pending:
+                    winner = succeeded[0] if succeeded else done.pop()
+                    if winner is hedge:
+                        self._stats["hedge_wins"] += 1
+                    for loser in pending:
+                        loser.cancel()
+                    return winner.result()
+        except asyncio.CancelledError:
+            primary.cancel()
+            if hedge is not None:
+                hedge.cancel()
+            raise
+        finally:
+            started_waiter.cancel()
+
+    def get_stats(self) -> Dict[str, Any]:
+        delay = self.latencies.percentile(self.percentile)
+        requests = self._stats["requests"]
+        return {
+            "enabled": self.enabled,
+            "percentile": self.percentile,
+            "hedge_delay_seconds": round(delay, 3) if delay is not None else None,
+            "samples": len(self.latencies),
+            "budget_percent": self.budget_percent,
+            "hedge_rate": round(self._stats["hedged"] / requests, 4) if requests else 0.0,
+            **self._stats
+        }
@@ -0,0 +1,82 @@
+import asyncio
+from typing import Dict, Any
+
+import aiohttp
+
+from app.core.resilience import TransientHTTPError
+
+
+class ConnectionStats:
+    """aiohttpのTraceConfigで接続の新規作成・再利用とDNSキャッシュの利用状況を数える"""
+
+    def __init__(self):
+        self.requests = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.dns_cache_hits = 0
+        self.dns_cache_misses = 0
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, context, params):
+            self.requests += 1
+
+        async def on_connection_create_end(session, context, params):
+            self.new_connections += 1
+
+        async def on_connection_reuseconn(session, context, params):
+            self.reused_connections += 1
+
+        async def on_dns_cache_hit(session, context, params):
+            self.dns_cache_hits += 1
+
+        async def on_dns_cache_miss(session, context, params):
+            self.dns_cache_misses += 1
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace_config.on_dns_cache_hit.append(on_dns_cache_hit)
+        trace_config.on_dns_cache_miss.append(on_dns_cache_miss)
+        return trace_config
+
+    def to_dict(self) -> Dict[str, Any]:
+        connections = self.new_connections + self.reused_connections
+        return {
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "reused_connections": self.reused_connections,
+            "reuse_rate": round(self.reused_connections / connections, 4) if connections else 0.0,
+            "dns_cache_hits": self.dns_cache_hits,
+            "dns_cache_misses": self.dns_cache_misses
+        }
+
+
+def create_client_session(stats: ConnectionStats, limit: int, keepalive_seconds: int, dns_cache_seconds: int) -> aiohttp.ClientSession:
+    """接続プール・キープアライブ・DNSキャッシュを設定した共有セッションを作成（イベントループ上で呼び出すこと）
+
+    タイムアウトはリクエストごとに指定する
+    """
+    connector = aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=limit,
+        keepalive_timeout=keepalive_seconds,
+        ttl_dns_cache=dns_cache_seconds,
+        use_dns_cache=True
+    )
+    return aiohttp.ClientSession(connector=connector, trace_configs=[stats.trace_config()])
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """再試行・サーキットブレーカーの対象となる一時的な障害（タイムアウト・接続失敗・5xx・429）か"""
+    return isinstance(error, (asyncio.TimeoutError, aiohttp.ClientConnectionError, TransientHTTPError))
+
+
+def is_unsent_error(error: BaseException) -> bool:
+    """接続を確立できず、リクエストが送られていないことが確実な障害か（冪等でない呼び出しも再試行できる）"""
+    return isinstance(error, aiohttp.ClientConnectorError)
+
+
+def is_transient_status(status: int) -> bool:
+    return status >= 500 or status == 429
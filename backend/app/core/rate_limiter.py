@@ -0,0 +1,74 @@
+import asyncio
+import time
+from typing import Dict, Any
+
+
+class TokenBucket:
+    """asyncio用のトークンバケット方式のレートリミッター
+
+    - 1秒あたり rate 個のトークンを補充し、最大 capacity 個まで貯める（短いバーストを許容）
+    - トークンがない場合は失敗させずに待機させる（待機は到着順）
+    - Retry-After を受け取った場合は pause() で指定時間すべての呼び出しを止める
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = max(rate, 0.001)
+        self.capacity = max(capacity, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+        self._stats = {
+            "acquired": 0,
+            "waited": 0,
+            "total_wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "retry_after_pauses": 0
+        }
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> float:
+        """トークンを1つ取得し、待機した秒数を返す"""
+        started = time.monotonic()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._blocked_until - now
+                if wait <= 0:
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        break
+                    wait = (1 - self._tokens) / self.rate
+                await asyncio.sleep(wait)
+
+        waited = time.monotonic() - started
+        self._stats["acquired"] += 1
+        if waited > 0.001:
+            self._stats["waited"] += 1
+            self._stats["total_wait_seconds"] += waited
+            self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], waited)
+        return waited
+
+    def pause(self, seconds: float):
+        """Retry-After などで指定された時間、トークンの払い出しを止める"""
+        now = time.monotonic()
+        self._blocked_until = max(self._blocked_until, now + max(seconds, 0))
+        self._refill(now)
+        self._tokens = 0
+        self._stats["retry_after_pauses"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """取得回数と待機時間の集計を取得"""
+        acquired = self._stats["acquired"]
+        return {
+            "rate_per_second": self.rate,
+            "capacity": self.capacity,
+            **self._stats,
+            "total_wait_seconds": round(self._stats["total_wait_seconds"], 3),
+            "max_wait_seconds": round(self._stats["max_wait_seconds"], 3),
+            "avg_wait_seconds": round(self._stats["total_wait_seconds"] / acquired, 4) if acquired else 0.0
+        }
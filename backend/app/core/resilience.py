@@ -0,0 +1,156 @@
+import asyncio
+import random
+import time
+from typing import Dict, Any, Awaitable, Callable, Optional, TypeVar
+
+from app.core import settings
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(Exception):
+    """サーキットブレーカーが開いているため、呼び出さずに失敗させた"""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name} は停止中と判断されています（{retry_in:.0f}秒後に再試行）")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class TransientHTTPError(Exception):
+    """再試行すれば成功し得るHTTPステータス（5xx・429）を受け取った"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def backoff_delay(attempt: int, base_seconds: float, max_seconds: float) -> float:
+    """指数バックオフの待機時間（full jitter: 0 〜 base * 2^attempt の一様乱数、max_seconds で頭打ち）"""
+    return random.uniform(0, min(max_seconds, base_seconds * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """エンドポイントごとのサーキットブレーカー
+
+    - closed: 通常どおり呼び出す。一時的な障害が failure_threshold 回続いたら open にする
+    - open: reset_seconds の間は呼び出さずに CircuitOpenError で即座に失敗させる
+    - half_open: reset_seconds 経過後、1件だけ試しに呼び出し、成功すれば closed、失敗すれば再び open にする
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = max(failure_threshold, 1)
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._stats = {
+            "successes": 0,
+            "failures": 0,
+            "rejected": 0,
+            "opened": 0
+        }
+
+    def before_call(self):
+        """呼び出し前に確認（開いていれば CircuitOpenError）"""
+        if self.state == "open":
+            elapsed = time.monotonic() - self._opened_at
+            if elapsed < self.reset_seconds:
+                self._stats["rejected"] += 1
+                raise CircuitOpenError(self.name, self.reset_seconds - elapsed)
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self._trial_in_flight:
+                self._stats["rejected"] += 1
+                raise CircuitOpenError(self.name, 0)
+            self._trial_in_flight = True
+
+    def record_success(self):
+        self._stats["successes"] += 1
+        self._consecutive_failures = 0
+        self._trial_in_flight = False
+        if self.state != "closed":
+            print(f"サーキットブレーカー {self.name} を閉じました（復旧を確認）")
+        self.state = "closed"
+
+    def record_failure(self):
+        self._stats["failures"] += 1
+        self._consecutive_failures += 1
+        self._trial_in_flight = False
+        if self.state == "half_open" or self._consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                self._stats["opened"] += 1
+                print(f"サーキットブレーカー {self.name} を開きました（{self.reset_seconds:.0f}秒間は呼び出しを止めます）")
+            self.state = "open"
+            self._opened_at = time.monotonic()
+
+    def abandon(self):
+        """呼び出しがキャンセルされた場合（成否を判断せず、試行中の枠だけ返す）"""
+        self._trial_in_flight = False
+
+    def get_stats(self) -> Dict[str, Any]:
+        retry_in = 0.0
+        if self.state == "open":
+            retry_in = max(self.reset_seconds - (time.monotonic() - self._opened_at), 0.0)
+        return {
+            "state": self.state,
+            "consecutive_failures": self._consecutive_failures,
+            "retry_in_seconds": round(retry_in, 1),
+            **self._stats
+        }
+
+
+class ResilientEndpoint:
+    """サーキットブレーカーと、ジッター付き指数バックオフによる再試行をまとめたエンドポイント
+
+    is_transient で一時的な障害（タイムアウト・接続失敗・5xxなど）と判定した例外のみブレーカーの失敗として数え、
+    idempotent=True の呼び出しはそれを再試行する。冪等でない呼び出しは、リクエストが送られていないことが
+    確実な例外（is_unsent で判定）の場合だけ再試行する。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        is_transient: Callable[[BaseException], bool],
+        is_unsent: Callable[[BaseException], bool] = lambda e: False,
+        max_attempts: Optional[int] = None
+    ):
+        self.name = name
+        self.is_transient = is_transient
+        self.is_unsent = is_unsent
+        self.max_attempts = max(max_attempts or settings.RETRY_MAX_ATTEMPTS, 1)
+        self.breaker = CircuitBreaker(name, settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD, settings.CIRCUIT_BREAKER_RESET_SECONDS)
+        self.retries = 0
+
+    async def call(self, func: Callable[..., Awaitable[T]], *args: Any, idempotent: bool = True, **kwargs: Any) -> T:
+        for attempt in range(self.max_attempts):
+            self.breaker.before_call()
+            try:
+                result = await func(*args, **kwargs)
+            except asyncio.CancelledError:
+                self.breaker.abandon()
+                raise
+            except Exception as e:
+                if not self.is_transient(e):
+                    # 4xxなど、相手は応答しているので障害としては数えない
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                retryable = idempotent or self.is_unsent(e)
+                if not retryable or attempt + 1 >= self.max_attempts or self.breaker.state == "open":
+                    raise
+                delay = backoff_delay(attempt, settings.RETRY_BASE_DELAY_SECONDS, settings.RETRY_MAX_DELAY_SECONDS)
+                self.retries += 1
+                print(f"{self.name} で一時的なエラーが発生したため{delay:.1f}秒後に再試行します（{attempt + 1}/{self.max_attempts}）: {e}")
+                await asyncio.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.breaker.get_stats(),
+            "retries": self.retries
+        }
@@ -13,6 +13,9 @@ GMAIL_EMAIL = os.getenv("GMAIL_EMAIL")
 GMAIL_PASSWORD = os.getenv("GMAIL_PASSWORD")
 GMAIL_IMAP_SERVER = os.getenv("GMAIL_IMAP_SERVER", "imap.gmail.com")
 GMAIL_IMAP_PORT = int(os.getenv("GMAIL_IMAP_PORT", "993"))
+# 認証済みIMAP接続を保持するプールの最大接続数と、NOOPで死活確認するまでの待機秒数
+IMAP_POOL_SIZE = int(os.getenv("IMAP_POOL_SIZE", "2"))
+IMAP_POOL_HEALTH_CHECK_SECONDS = int(os.getenv("IMAP_POOL_HEALTH_CHECK_SECONDS", "60"))
 
 # SMTP Settings (for future use)
 SMTP_SERVER = os.getenv("SMTP_SERVER")
@@ -24,21 +27,104 @@ SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
 X_API_URL = os.getenv("X_API_URL", "https://api.x.com/upload")
 X_API_KEY = os.getenv("X_API_KEY")
 X_API_EXPIRE_HOURS = int(os.getenv("X_API_EXPIRE_HOURS", "744"))
+# X-APIへのアップロードで共有するHTTPセッションの接続プール上限・キープアライブ秒数・DNSキャッシュ秒数
+X_API_HTTP_POOL_LIMIT = int(os.getenv("X_API_HTTP_POOL_LIMIT", "10"))
+X_API_HTTP_KEEPALIVE_SECONDS = int(os.getenv("X_API_HTTP_KEEPALIVE_SECONDS", "60"))
+X_API_HTTP_DNS_CACHE_SECONDS = int(os.getenv("X_API_HTTP_DNS_CACHE_SECONDS", "300"))
+# アップロード1件あたりのタイムアウト（秒）
+X_API_CONNECT_TIMEOUT_SECONDS = int(os.getenv("X_API_CONNECT_TIMEOUT_SECONDS", "10"))
+X_API_TIMEOUT_SECONDS = int(os.getenv("X_API_TIMEOUT_SECONDS", "30"))
 
 # Dify Settings
 DIFY_BASE_URL = os.getenv("DIFY_BASE_URL", "http://p00-log001a.rsf-node001.com")
 DIFY_API_TOKEN = os.getenv("DIFY_API_TOKEN")
 DIFY_API_TOKEN_SEARCH = os.getenv("DIFY_API_TOKEN_SEARCH")
+# Difyのファイルアップロード・ワークフロー実行で共有するHTTPセッションの接続プール上限・キープアライブ秒数・DNSキャッシュ秒数
+DIFY_HTTP_POOL_LIMIT = int(os.getenv("DIFY_HTTP_POOL_LIMIT", "10"))
+DIFY_HTTP_KEEPALIVE_SECONDS = int(os.getenv("DIFY_HTTP_KEEPALIVE_SECONDS", "60"))
+DIFY_HTTP_DNS_CACHE_SECONDS = int(os.getenv("DIFY_HTTP_DNS_CACHE_SECONDS", "300"))
+# リクエストごとのタイムアウト（秒）。ワークフロー実行はblockingモードのためOCR完了まで待つ
+DIFY_CONNECT_TIMEOUT_SECONDS = int(os.getenv("DIFY_CONNECT_TIMEOUT_SECONDS", "10"))
+DIFY_UPLOAD_TIMEOUT_SECONDS = int(os.getenv("DIFY_UPLOAD_TIMEOUT_SECONDS", "60"))
+DIFY_WORKFLOW_TIMEOUT_SECONDS = int(os.getenv("DIFY_WORKFLOW_TIMEOUT_SECONDS", "300"))
+# workflows/run の同時実行数をAIMDで自動調整する範囲と初期値、混雑時の縮小率
+DIFY_ADAPTIVE_MIN_CONCURRENCY = int(os.getenv("DIFY_ADAPTIVE_MIN_CONCURRENCY", "1"))
+DIFY_ADAPTIVE_MAX_CONCURRENCY = int(os.getenv("DIFY_ADAPTIVE_MAX_CONCURRENCY", "8"))
+DIFY_ADAPTIVE_INITIAL_CONCURRENCY = int(os.getenv("DIFY_ADAPTIVE_INITIAL_CONCURRENCY", "2"))
+DIFY_ADAPTIVE_DECREASE_FACTOR = float(os.getenv("DIFY_ADAPTIVE_DECREASE_FACTOR", "0.5"))
+# この応答時間（秒）以内に収まっている間だけ同時実行数を増やす
+DIFY_OCR_TARGET_LATENCY_SECONDS = float(os.getenv("DIFY_OCR_TARGET_LATENCY_SECONDS", "30"))
+DIFY_SEARCH_TARGET_LATENCY_SECONDS = float(os.getenv("DIFY_SEARCH_TARGET_LATENCY_SECONDS", "10"))
+# OCRのヘッジ: 応答が直近のパーセンタイル（%）を過ぎたら重複リクエストを送る。全体の何%までヘッジするか、
+# ヘッジを始めるまでに必要な応答時間のサンプル数、パーセンタイルを求める直近の件数
+DIFY_OCR_HEDGE_ENABLED = os.getenv("DIFY_OCR_HEDGE_ENABLED", "false").lower() == "true"
+DIFY_OCR_HEDGE_PERCENTILE = float(os.getenv("DIFY_OCR_HEDGE_PERCENTILE", "95"))
+DIFY_OCR_HEDGE_BUDGET_PERCENT = float(os.getenv("DIFY_OCR_HEDGE_BUDGET_PERCENT", "5"))
+DIFY_OCR_HEDGE_MIN_SAMPLES = int(os.getenv("DIFY_OCR_HEDGE_MIN_SAMPLES", "20"))
+DIFY_OCR_HEDGE_WINDOW = int(os.getenv("DIFY_OCR_HEDGE_WINDOW", "200"))
 
 # Notion Settings
 NOTION_TOKEN = os.getenv("NOTION_TOKEN")
 NOTION_DATABASE_ID = os.getenv("NOTION_DATABASE_ID")
 NOTION_CLIENT_DATABASE_ID = os.getenv("NOTION_CLIENT_DATABASE_ID")
+# Notion APIのレート制限（平均3リクエスト/秒）。超える分は待機させ、429はRetry-Afterに従って再試行する
+NOTION_RATE_LIMIT_PER_SECOND = float(os.getenv("NOTION_RATE_LIMIT_PER_SECOND", "3"))
+NOTION_RATE_LIMIT_BURST = int(os.getenv("NOTION_RATE_LIMIT_BURST", "3"))
+NOTION_RATE_LIMIT_MAX_RETRIES = int(os.getenv("NOTION_RATE_LIMIT_MAX_RETRIES", "5"))
+# クライアントDBの差分同期間隔（分）と、削除を反映するためのフル同期間隔（時間）
+NOTION_CLIENT_SYNC_INTERVAL_MINUTES = int(os.getenv("NOTION_CLIENT_SYNC_INTERVAL_MINUTES", "5"))
+NOTION_CLIENT_FULL_SYNC_HOURS = int(os.getenv("NOTION_CLIENT_FULL_SYNC_HOURS", "24"))
+# ローカルのクライアント照合: 一致と判定する類似度・次点との最小差・該当なしとする類似度（0で無効。一致と判定できない場合はDifyで判定）
+CLIENT_MATCH_ACCEPT_SCORE = float(os.getenv("CLIENT_MATCH_ACCEPT_SCORE", "0.8"))
+CLIENT_MATCH_AMBIGUITY_MARGIN = float(os.getenv("CLIENT_MATCH_AMBIGUITY_MARGIN", "0.1"))
+CLIENT_MATCH_REJECT_SCORE = float(os.getenv("CLIENT_MATCH_REJECT_SCORE", "0"))
+# Difyで判定する場合に送信する候補数（ローカル照合の上位K件）
+CLIENT_MATCH_DIFY_TOP_K = int(os.getenv("CLIENT_MATCH_DIFY_TOP_K", "20"))
 
 # File Storage
 STORAGE_PATH = os.getenv("STORAGE_PATH", "./storage")
 EMAIL_STORAGE_PATH = f"{STORAGE_PATH}/emails"
 PDF_STORAGE_PATH = f"{STORAGE_PATH}/pdfs"
 
+# OCR Result Cache（PDFの内容ハッシュ → DifyのOCR結果）
+OCR_CACHE_MAX_AGE_DAYS = int(os.getenv("OCR_CACHE_MAX_AGE_DAYS", "30"))
+OCR_CACHE_MAX_SIZE_MB = int(os.getenv("OCR_CACHE_MAX_SIZE_MB", "100"))
+
 # Polling Settings
 EMAIL_POLLING_INTERVAL_MINUTES = int(os.getenv("EMAIL_POLLING_INTERVAL_MINUTES", "5"))
+# uid: UIDVALIDITY と最終UIDを保存して新着分のみ取得 / since: 前回ポーリング日以降を毎回検索
+EMAIL_SYNC_MODE = os.getenv("EMAIL_SYNC_MODE", "uid").lower()
+EMAIL_MAILBOX = os.getenv("EMAIL_MAILBOX", "inbox")
+# structure: BODYSTRUCTUREを一括取得してPDFパートのみダウンロード（uidモード時のみ） / full: メール全体を1件ずつ取得
+EMAIL_FETCH_MODE = os.getenv("EMAIL_FETCH_MODE", "structure").lower()
+EMAIL_FETCH_BATCH_SIZE = int(os.getenv("EMAIL_FETCH_BATCH_SIZE", "100"))
+# メール本体・PDFパートを分割取得する際の1回あたりのバイト数（メッセージごとのピークメモリの上限）
+EMAIL_FETCH_CHUNK_SIZE = int(os.getenv("EMAIL_FETCH_CHUNK_SIZE", str(1024 * 1024)))
+# 本文（text/plain）として取得・保持する最大バイト数（超えた分は読み捨てる）
+EMAIL_BODY_MAX_BYTES = int(os.getenv("EMAIL_BODY_MAX_BYTES", str(1024 * 1024)))
+# IMAP IDLEで新着を即時検知する（インターバルポーリングはフォールバックとして継続）
+EMAIL_IDLE_ENABLED = os.getenv("EMAIL_IDLE_ENABLED", "false").lower() == "true"
+# サーバーの29分タイムアウトより前にIDLEを再発行する間隔（分）
+EMAIL_IDLE_RENEW_MINUTES = int(os.getenv("EMAIL_IDLE_RENEW_MINUTES", "25"))
+
+# Pipeline Concurrency（外部サービスごとの同時実行数の上限）
+X_API_CONCURRENCY = int(os.getenv("X_API_CONCURRENCY", "4"))
+# Difyへのファイルアップロード（workflows/run は DIFY_ADAPTIVE_* で自動調整）
+DIFY_CONCURRENCY = int(os.getenv("DIFY_CONCURRENCY", "2"))
+NOTION_CONCURRENCY = int(os.getenv("NOTION_CONCURRENCY", "3"))
+# 取得済みメールを外部API処理へ渡すワーカー数と、待機できるメール数の上限（超えるとIMAP取得を一時停止）
+EMAIL_PIPELINE_WORKERS = int(os.getenv("EMAIL_PIPELINE_WORKERS", "4"))
+EMAIL_QUEUE_MAXSIZE = int(os.getenv("EMAIL_QUEUE_MAXSIZE", "8"))
+# Notion登録まで完了したPDFの進捗記録を保持する日数
+WORK_QUEUE_RETENTION_DAYS = int(os.getenv("WORK_QUEUE_RETENTION_DAYS", "7"))
+# PDFごとの外部API処理の試行回数の上限（達したPDFは自動では再試行せず、/status に表示する）
+WORK_QUEUE_MAX_ATTEMPTS = int(os.getenv("WORK_QUEUE_MAX_ATTEMPTS", "5"))
+
+# Resilience（一時的な障害の再試行とサーキットブレーカー）
+# 1回の呼び出しあたりの試行回数と、ジッター付き指数バックオフの基準・上限の待機秒数
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY_SECONDS = float(os.getenv("RETRY_BASE_DELAY_SECONDS", "1"))
+RETRY_MAX_DELAY_SECONDS = float(os.getenv("RETRY_MAX_DELAY_SECONDS", "30"))
+# 一時的な障害がこの回数続いたら、そのエンドポイントの呼び出しを一定時間（秒）止めて即座に失敗させる
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_BREAKER_FAILURE_THRESHOLD", "5"))
+CIRCUIT_BREAKER_RESET_SECONDS = float(os.getenv("CIRCUIT_BREAKER_RESET_SECONDS", "60"))
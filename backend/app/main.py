@@ -5,13 +5,20 @@ from fastapi.middleware.cors import CORSMiddleware
 from app.core import settings
 from app.api.v1.router import api_v1_router
 from app.scheduler.main import start_scheduler, stop_scheduler
+from app.scheduler.jobs.email_polling_job import cancel_email_polling_job
+from app.services.registry import ServiceRegistry
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    start_scheduler()
+    # スケジューラーとAPIで共有するサービスを生成
+    services = ServiceRegistry()
+    app.state.services = services
+    start_scheduler(services)
     yield
     stop_scheduler()
+    await cancel_email_polling_job()
+    await services.aclose()
 
 
 app = FastAPI(
@@ -1,87 +1,208 @@
 import asyncio
+import os
+from contextlib import aclosing
+from typing import Optional
+from app.core import settings
 from app.services.email_service import EmailService
 from app.services.x_api_service import XApiService
 from app.services.dify_service import DifyService
 from app.services.notion_service import NotionService
+from app.services.ocr_cache import OcrCache
+from app.services.client_matcher import to_fuzzy_search_result
+from app.services.registry import ServiceRegistry
+from app.services.work_queue import DocumentWorkQueue, STAGES
 
 
-async def process_email_with_apis(email_data: dict, x_api_service: XApiService, dify_service: DifyService, notion_service: NotionService, email_service: EmailService):
-    """メールデータを外部APIで処理"""
-    email_info = email_data["email_info"]
-    pdf_files = email_data["pdf_files"]
-    email_id = email_data["email_id"]
+class ServiceLimits:
+    """外部サービスごとの同時実行数の上限（ジョブを実行するイベントループ内で生成すること）"""
     
-    # 処理成功フラグ
-    all_pdfs_processed = True
+    def __init__(self):
+        self.x_api = asyncio.Semaphore(max(settings.X_API_CONCURRENCY, 1))
+        self.dify = asyncio.Semaphore(max(settings.DIFY_CONCURRENCY, 1))
+        self.notion = asyncio.Semaphore(max(settings.NOTION_CONCURRENCY, 1))
+
+
+async def _upload_to_x_api(pdf_file: str, x_api_service: XApiService, limits: ServiceLimits) -> dict:
+    """X-APIにアップロード"""
+    print("X-APIにファイルをアップロード中...")
+    async with limits.x_api:
+        upload_result = await x_api_service.upload_pdf(pdf_file)
     
-    # 各PDFファイルを処理
-    for pdf_file in pdf_files:
-        try:
+    if upload_result.get("status") == "success":
+        print("✅ X-APIアップロード成功!")
+        upload_data = upload_result.get("data", {})
+        print(f"X-API結果構造: {upload_result}")
+        if "url" in upload_data:
+            print(f"🔗 アップロードURL: {upload_data['url']}")
+            print(f"📅 有効期限: {upload_data.get('end_datetime', 'N/A')}")
+    else:
+        print(f"❌ X-APIアップロード失敗: {upload_result.get('message')}")
+    
+    return upload_result
+
+
+async def _run_ocr(pdf_file: str, pdf_hash: str, dify_service: DifyService, ocr_cache: OcrCache, limits: ServiceLimits) -> dict:
+    """DifyでOCR処理（同じ内容のPDFを処理済みであれば、キャッシュ済みのOCR結果を使用）"""
+    ocr_result = await asyncio.to_thread(ocr_cache.get, pdf_hash) if pdf_hash else None
+    
+    if ocr_result is not None:
+        print(f"OCR結果をキャッシュから取得しました: {pdf_hash}")
+        return ocr_result
+    
+    print("DifyでOCR処理を開始...")
+    async with limits.dify:
+        # ファイルアップロード
+        file_id = await dify_service.upload_file(pdf_file)
+    print(f"Difyファイルアップロード完了: {file_id}")
+    
+    # OCR処理（PDFファイルなので file_type を "document" に指定）
+    # ワークフローの同時実行数は DifyService 側で応答時間に応じて調整する
+    ocr_result = await dify_service.process_ocr(file_id, file_type="document")
+    
+    # 失敗（停止中のサーキットブレーカー・再試行しても解消しない障害を含む）はOCR結果なしで登録せず、
+    # PDFを未完了のまま残して次回のジョブで再試行する
+    if isinstance(ocr_result, dict) and ocr_result.get("status") == "error":
+        raise Exception(f"OCR処理失敗: {ocr_result.get('message')}")
+    
+    if pdf_hash:
+        await asyncio.to_thread(ocr_cache.put, pdf_hash, ocr_result)
+    return ocr_result
+
+
+def _extract_vendor(ocr_result) -> str:
+    """OCR結果からvendor情報を抽出"""
+    if isinstance(ocr_result, dict) and "result" in ocr_result:
+        result_data = ocr_result["result"]
+        if isinstance(result_data, dict) and "data" in result_data:
+            data_list = result_data["data"]
+            if isinstance(data_list, list) and len(data_list) > 0:
+                first_item = data_list[0]
+                if isinstance(first_item, dict):
+                    return first_item.get("vendor", "")
+    return ""
+
+
+async def _match_client(vendor: str, notion_service: NotionService, dify_service: DifyService, limits: ServiceLimits):
+    """vendorに一致するクライアントを照合（メモにもなくローカルで判定できない場合のみDifyで曖昧検索）"""
+    print(f"クライアント曖昧検索を実行中: {vendor}")
+    
+    # Notionクライアントのスナップショット（未同期の場合のみNotionから取得）
+    async with limits.notion:
+        all_clients = await notion_service.get_all_clients()
+    
+    if not all_clients:
+        return None
+    
+    # 以前に解決したvendorはメモの結果を使う（クライアントデータが変わるとメモは破棄される）
+    memo_result = await notion_service.lookup_vendor_match(vendor)
+    if memo_result is not None:
+        print(f"曖昧検索結果（メモ）: {memo_result}")
+        return memo_result
+    
+    # 文字n-gram索引でローカル照合し、候補が拮抗している場合のみDifyに判定させる
+    match = notion_service.client_matcher.match(vendor)
+    if match["decision"] != "ambiguous":
+        fuzzy_search_result = to_fuzzy_search_result(match)
+        print(f"曖昧検索結果（ローカル照合: {match['decision']}）: {fuzzy_search_result}")
+        return fuzzy_search_result
+    
+    # ローカルで順位付けした上位の候補のみをDifyに送信（クライアント数に比例して送信サイズが増えないように）
+    candidates = notion_service.client_matcher.candidates(vendor, limit=max(settings.CLIENT_MATCH_DIFY_TOP_K, 1))
+    if not candidates:
+        # 共通する文字が1つもない場合はDifyに送らず、該当なしとする
+        fuzzy_search_result = to_fuzzy_search_result({"client": None, "score": 0.0})
+        print(f"ローカル照合で候補が見つからないため該当なしとします: {fuzzy_search_result}")
+        return fuzzy_search_result
+    print(f"ローカル照合では候補が絞り込めないためDifyで判定します: {[(c['name'], score) for c, score in candidates]}")
+    
+    # クライアント情報をDifyに送信しやすい形式に変換
+    notion_clients_for_dify = [
+        {
+            "id": client["id"],
+            "name": client["name"],
+            "abbreviation": client["abbreviation"]
+        }
+        for client, _ in candidates
+    ]
+    
+    # Difyで曖昧検索を実行
+    fuzzy_search_result = await dify_service.search_client_fuzzy(
+        vendor,
+        notion_clients_for_dify
+    )
+    print(f"曖昧検索結果: {fuzzy_search_result}")
+    
+    # 失敗した場合はクライアント未設定のまま登録せず、次回のジョブで照合からやり直す
+    if isinstance(fuzzy_search_result, dict) and fuzzy_search_result.get("status") == "error":
+        raise Exception(f"曖昧検索失敗: {fuzzy_search_result.get('message')}")
+    
+    await notion_service.remember_vendor_match(vendor, fuzzy_search_result)
+    return fuzzy_search_result
+
+
+async def process_pdf_with_apis(pdf_file: str, pdf_hash: str, email_info: dict, x_api_service: XApiService, dify_service: DifyService, notion_service: NotionService, email_service: EmailService, ocr_cache: OcrCache, work_queue: DocumentWorkQueue, limits: ServiceLimits) -> bool:
+    """PDFファイル1件を外部APIで処理し、Notionへの登録に成功したかを返す
+    
+    各段階の結果はワークキューに保存し、前回までに完了した段階は保存済みの結果を使って省略する
+    """
+    try:
+        doc = await asyncio.to_thread(work_queue.get, pdf_file) or {"stage": "stored"}
+        if doc["stage"] == "registered":
+            print(f"PDF {pdf_file} は登録済みのためスキップします")
+            return True
+        
+        upload_result = doc.get("upload_result")
+        ocr_result = doc.get("ocr_result")
+        if (upload_result is None or ocr_result is None) and not os.path.exists(pdf_file):
+            # 未完了の段階に必要なPDFが失われている場合は再試行できない
+            print(f"❌ PDFファイルが見つからないため処理を中止します: {pdf_file}")
+            await asyncio.to_thread(work_queue.remove, pdf_file)
+            return False
+        
+        if doc["stage"] != "stored":
+            print(f"PDF {pdf_file} の処理を再開します（完了済みの段階: {doc['stage']}）")
+        else:
             print(f"PDF {pdf_file} の処理を開始します...")
-            
-            # X-APIにアップロード
-            print("X-APIにファイルをアップロード中...")
-            upload_result = await x_api_service.upload_pdf(pdf_file)
-            
-            if upload_result.get("status") == "success":
-                print("✅ X-APIアップロード成功!")
-                upload_data = upload_result.get("data", {})
-                print(f"X-API結果構造: {upload_result}")
-                if "url" in upload_data:
-                    print(f"🔗 アップロードURL: {upload_data['url']}")
-                    print(f"📅 有効期限: {upload_data.get('end_datetime', 'N/A')}")
-
-            else:
-                print(f"❌ X-APIアップロード失敗: {upload_result.get('message')}")
-            
-            # DifyでOCR処理
-            print("DifyでOCR処理を開始...")
-            # ファイルアップロード
-            file_id = await dify_service.upload_file(pdf_file)
-            print(f"Difyファイルアップロード完了: {file_id}")
-            
-            # OCR処理（PDFファイルなので file_type を "document" に指定）
-            ocr_result = await dify_service.process_ocr(file_id, file_type="document")
-            print(f"OCR結果: {ocr_result}")
-            
-            # OCR結果からvendor情報を抽出して曖昧検索を実行
-            vendor = ""
-            if isinstance(ocr_result, dict) and "result" in ocr_result:
-                result_data = ocr_result["result"]
-                if isinstance(result_data, dict) and "data" in result_data:
-                    data_list = result_data["data"]
-                    if isinstance(data_list, list) and len(data_list) > 0:
-                        first_item = data_list[0]
-                        if isinstance(first_item, dict):
-                            vendor = first_item.get("vendor", "")
-            
-            # vendorが存在する場合、曖昧検索を実行
-            fuzzy_search_result = None
-            if vendor:
-                print(f"クライアント曖昧検索を実行中: {vendor}")
-                
-                # NotionからクライアントDBの全データを取得
-                all_clients = await notion_service.get_all_clients()
-                
-                if all_clients:
-                    # クライアント情報をDifyに送信しやすい形式に変換
-                    notion_clients_for_dify = [
-                        {
-                            "id": client["id"],
-                            "name": client["name"],
-                            "abbreviation": client["abbreviation"]
-                        }
-                        for client in all_clients
-                    ]
-                    
-                    # Difyで曖昧検索を実行
-                    fuzzy_search_result = await dify_service.search_client_fuzzy(
-                        vendor,
-                        notion_clients_for_dify
-                    )
-                    print(f"曖昧検索結果: {fuzzy_search_result}")
-            
-            # Notionに登録
+        
+        async def upload():
+            result = await _upload_to_x_api(pdf_file, x_api_service, limits)
+            if result.get("retryable"):
+                # 停止中・一時的な障害の場合は登録せず、次回のジョブでアップロードからやり直す
+                raise Exception(f"X-APIアップロード失敗: {result.get('message')}")
+            if result.get("status") == "success":
+                await asyncio.to_thread(work_queue.record, pdf_file, "uploaded", upload_result=result)
+            return result
+        
+        async def ocr():
+            result = await _run_ocr(pdf_file, pdf_hash, dify_service, ocr_cache, limits)
+            await asyncio.to_thread(work_queue.record, pdf_file, "ocr", ocr_result=result)
+            return result
+        
+        # X-APIアップロードとOCRは互いに独立しているため、未完了のものを並行して実行
+        pending = {}
+        if upload_result is None:
+            pending["upload"] = upload()
+        if ocr_result is None:
+            pending["ocr"] = ocr()
+        results = await asyncio.gather(*pending.values(), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        results = dict(zip(pending.keys(), results))
+        upload_result = results.get("upload", upload_result)
+        ocr_result = results.get("ocr", ocr_result)
+        print(f"OCR結果: {ocr_result}")
+        
+        # OCR結果からvendor情報を抽出して曖昧検索を実行（完了済みなら保存済みの結果を使用）
+        if STAGES.index(doc["stage"]) >= STAGES.index("matched"):
+            fuzzy_search_result = doc.get("fuzzy_search_result")
+        else:
+            vendor = _extract_vendor(ocr_result)
+            fuzzy_search_result = await _match_client(vendor, notion_service, dify_service, limits) if vendor else None
+            await asyncio.to_thread(work_queue.record, pdf_file, "matched", fuzzy_search_result=fuzzy_search_result)
+        
+        # Notionに登録
+        async with limits.notion:
             notion_result = await notion_service.create_entry({
                 **email_info,
                 "pdf_file": pdf_file,
@@ -89,69 +210,173 @@ async def process_email_with_apis(email_data: dict, x_api_service: XApiService,
                 "ocr_result": ocr_result,
                 "fuzzy_search_result": fuzzy_search_result  # 曖昧検索結果も含める
             })
-            
-            if notion_result.get("status") == "success":
-                print(f"✅ Notion登録成功: {notion_result.get('url')}")
-                
-                # 処理成功したPDFファイルを削除
-                if await email_service.delete_pdf_file(pdf_file):
-                    print(f"✅ PDFファイルを削除しました: {pdf_file}")
-                else:
-                    print(f"⚠️ PDFファイルの削除に失敗しました: {pdf_file}")
-            else:
-                print(f"❌ Notion登録失敗: {notion_result.get('message')}")
-                all_pdfs_processed = False
-            
-            print(f"✅ PDF {pdf_file} の外部API処理が完了しました")
-            
-        except Exception as e:
-            print(f"PDF {pdf_file} の外部API処理でエラーが発生しました: {e}")
-            all_pdfs_processed = False
+        
+        if notion_result.get("status") != "success":
+            print(f"❌ Notion登録失敗: {notion_result.get('message')}")
+            await asyncio.to_thread(work_queue.record_failure, pdf_file, f"Notion登録失敗: {notion_result.get('message')}")
+            return False
+        
+        await asyncio.to_thread(work_queue.record, pdf_file, "registered", notion_result=notion_result)
+        print(f"✅ Notion登録成功: {notion_result.get('url')}")
+        
+        # 処理成功したPDFファイルを削除
+        if await email_service.delete_pdf_file(pdf_file):
+            print(f"✅ PDFファイルを削除しました: {pdf_file}")
+        else:
+            print(f"⚠️ PDFファイルの削除に失敗しました: {pdf_file}")
+        
+        print(f"✅ PDF {pdf_file} の外部API処理が完了しました")
+        return True
+        
+    except Exception as e:
+        print(f"PDF {pdf_file} の外部API処理でエラーが発生しました: {e}")
+        try:
+            await asyncio.to_thread(work_queue.record_failure, pdf_file, str(e))
+        except Exception as record_error:
+            print(f"ワークキューへの失敗記録エラー: {record_error}")
+        return False
+
+
+async def process_email_with_apis(email_data: dict, x_api_service: XApiService, dify_service: DifyService, notion_service: NotionService, email_service: EmailService, ocr_cache: OcrCache, work_queue: DocumentWorkQueue, limits: ServiceLimits):
+    """メールデータを外部APIで処理（メール内のPDFは並行して処理）"""
+    email_info = email_data["email_info"]
+    pdf_files = email_data["pdf_files"]
+    pdf_hashes = email_data.get("pdf_hashes", {})
+    email_id = email_data["email_id"]
+    
+    results = await asyncio.gather(*[
+        process_pdf_with_apis(
+            pdf_file, pdf_hashes.get(pdf_file), email_info,
+            x_api_service, dify_service, notion_service, email_service, ocr_cache, work_queue, limits
+        )
+        for pdf_file in pdf_files
+    ])
     
     # すべてのPDFが正常に処理された場合、メールファイルも削除
-    if all_pdfs_processed and pdf_files:
+    # （失敗したPDFとメールファイルは残し、成功したPDFのみ削除済み。失敗したPDFは次回のジョブで再試行される）
+    if pdf_files and all(results):
         if await email_service.delete_email_file(email_id):
             print(f"✅ メールファイルを削除しました: {email_id}.eml")
         else:
             print(f"⚠️ メールファイルの削除に失敗しました: {email_id}.eml")
+    elif pdf_files:
+        print(f"⚠️ メールID {email_id}: {results.count(False)}/{len(pdf_files)}件のPDF処理に失敗しました")
+
+
+# 実行中のジョブ（インターバル実行・IDLE検知・手動実行で共有し、重複実行を防ぐ）
+_current_run: Optional[asyncio.Task] = None
+_rerun_requested = False
 
 
-def execute_email_polling_job():
-    """メールポーリングジョブを実行"""
+async def execute_email_polling_job(services: ServiceRegistry) -> dict:
+    """共有サービスを使ってメールポーリングジョブを実行し、結果を返す
+    
+    実行中に別のトリガーが来た場合は新たに実行せず、現在の実行完了後にもう一度だけ実行してその結果を返す
+    """
+    global _current_run, _rerun_requested
+    if _current_run is not None and not _current_run.done():
+        print("メールポーリングジョブは実行中のため、完了後に再実行します")
+        _rerun_requested = True
+    else:
+        _rerun_requested = False
+        _current_run = asyncio.create_task(_run_until_settled(services))
+    # 呼び出し元（HTTPリクエストなど）がキャンセルされてもジョブは継続させる
+    return await asyncio.shield(_current_run)
+
+
+async def cancel_email_polling_job():
+    """実行中のジョブを中断する（進捗はワークキューに保存済みのため、次回起動時に再開される）"""
+    run = _current_run
+    if run is None or run.done():
+        return
+    run.cancel()
+    try:
+        await run
+    except asyncio.CancelledError:
+        pass
+
+
+async def _run_until_settled(services: ServiceRegistry) -> dict:
+    global _rerun_requested
+    while True:
+        result = await _run_email_polling_job(services)
+        if not _rerun_requested:
+            return result
+        _rerun_requested = False
+
+
+async def run_email_pipeline(email_service: EmailService, x_api_service: XApiService, dify_service: DifyService, notion_service: NotionService, ocr_cache: OcrCache) -> dict:
+    """メール取得（プロデューサー）と外部API処理（ワーカー）を上限付きキューでつないで実行
+    
+    メールは取り出された時点でキューに入り、空いているワーカーがすぐに外部API処理を開始する。
+    キューが満杯の間はIMAPからの取得を一時停止する（バックプレッシャー）。
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(settings.EMAIL_QUEUE_MAXSIZE, 1))
+    worker_count = max(settings.EMAIL_PIPELINE_WORKERS, 1)
+    limits = ServiceLimits()
+    work_queue = email_service.work_queue
+    summary: dict = {}
+    
+    async def produce():
+        try:
+            # 前回までに完了しなかったPDFを先に再開する
+            await asyncio.to_thread(work_queue.purge_registered, settings.WORK_QUEUE_RETENTION_DAYS)
+            resumed_emails = await asyncio.to_thread(work_queue.pending_emails)
+            if resumed_emails:
+                print(f"未完了のPDFを再開します: {sum(len(e['pdf_files']) for e in resumed_emails)}件")
+            summary["resumed_count"] = len(resumed_emails)
+            for email_data in resumed_emails:
+                await queue.put(email_data)
+            
+            emails = summary.setdefault("emails", [])
+            # 途中で終了・キャンセルされても、ジェネレーターを閉じて借りているIMAP接続をプールに返す
+            async with aclosing(email_service.iter_new_emails(summary)) as new_emails:
+                async for email_data in new_emails:
+                    emails.append({key: email_data[key] for key in ("email_id", "subject", "from", "date", "pdf_files")})
+                    if email_data["pdf_files"]:  # PDFファイルがある場合のみ処理
+                        await queue.put(email_data)
+                    else:
+                        print(f"メールID {email_data['email_id']} にはPDFファイルが含まれていません。スキップします。")
+        except Exception as e:
+            summary["error"] = str(e)
+        
+        # ワーカーごとに終了の合図を送る
+        # （キャンセル時はワーカーもキャンセル済みでキューが空かないため送らない）
+        for _ in range(worker_count):
+            await queue.put(None)
+    
+    async def consume():
+        while True:
+            email_data = await queue.get()
+            if email_data is None:
+                return
+            await process_email_with_apis(email_data, x_api_service, dify_service, notion_service, email_service, ocr_cache, work_queue, limits)
+    
+    await asyncio.gather(produce(), *[consume() for _ in range(worker_count)])
+    return summary
+
+
+async def _run_email_polling_job(services: ServiceRegistry) -> dict:
+    """メールポーリングと外部API連携処理を1回実行"""
     try:
         print("メールポーリングジョブを開始します...")
         
-        # 非同期関数を同期的に実行
-        email_service = EmailService()
-        result = asyncio.run(email_service.poll_emails())
+        # メール取得と外部API処理を同時に進める
+        result = await run_email_pipeline(
+            services.email_service, services.x_api_service, services.dify_service,
+            services.notion_service, services.ocr_cache
+        )
         
         if "error" in result:
             print(f"メールポーリングでエラーが発生しました: {result['error']}")
-            return
-        
-        print(f"メール取得完了: {result['processed_count']}件のメールを処理しました")
-        
-        # 外部API連携サービスを初期化
-        x_api_service = XApiService()
-        dify_service = DifyService()
-        notion_service = NotionService()
-        
-        # 取得したメールデータを外部APIで処理
-        processed_emails = result.get("emails", [])
-        
-        async def process_all_emails():
-            for email_data in processed_emails:
-                if email_data["pdf_files"]:  # PDFファイルがある場合のみ処理
-                    await process_email_with_apis(email_data, x_api_service, dify_service, notion_service, email_service)
-                else:
-                    print(f"メールID {email_data['email_id']} にはPDFファイルが含まれていません。スキップします。")
         
-        # 外部API処理を実行
-        if processed_emails:
-            asyncio.run(process_all_emails())
-            print(f"外部API連携処理が完了しました")
+        processed_count = result.get("processed_count", 0)
+        if processed_count or result.get("resumed_count"):
+            print(f"メール取得・外部API連携処理が完了しました: {processed_count}件のメールを処理しました")
         else:
             print("処理対象のメールがありませんでした")
+        return result
             
     except Exception as e:
         print(f"メールポーリングジョブでエラーが発生しました: {e}")
+        return {"error": str(e)}
@@ -0,0 +1,9 @@
+from app.services.registry import ServiceRegistry
+
+
+async def execute_notion_client_sync_job(services: ServiceRegistry):
+    """NotionクライアントDBをローカルスナップショットに同期（ドキュメント処理とは別に定期実行）"""
+    try:
+        await services.notion_service.sync_clients()
+    except Exception as e:
+        print(f"クライアントデータ同期ジョブでエラーが発生しました: {e}")
@@ -1,27 +1,56 @@
-from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
+from datetime import datetime
 import atexit
 
 from app.core import settings
 from app.scheduler.jobs.email_polling_job import execute_email_polling_job
+from app.scheduler.jobs.notion_client_sync_job import execute_notion_client_sync_job
+from app.services.email_idle_listener import EmailIdleListener
+from app.services.registry import ServiceRegistry
 
-scheduler = BackgroundScheduler(
+# ジョブはFastAPIのイベントループ上で実行する（セッション・キャッシュ・接続を実行間で維持するため）
+scheduler = AsyncIOScheduler(
     job_defaults={
         'coalesce': True,
         'max_instances': 1
     }
 )
 
+idle_listener = None
+services = None
+
+
+def trigger_email_polling_job():
+    """新着メール検知時にメールポーリングジョブを即時実行（IDLEリスナーのスレッドから呼び出される）"""
+    try:
+        scheduler.add_job(
+            func=execute_email_polling_job,
+            args=[services],
+            id='email_polling_job_push',
+            name='Email Polling Job (IDLE)',
+            max_instances=1,
+            replace_existing=True
+        )
+    except Exception as e:
+        print(f"メールポーリングジョブの即時実行でエラーが発生しました: {e}")
+
+
+def start_scheduler(registry: ServiceRegistry):
+    """スケジューラーを開始（実行中のイベントループ上で呼び出すこと）"""
+    global idle_listener, services
 
-def start_scheduler():
     try:
         if scheduler.running:
             print("スケジューラーは既に実行中です")
             return
 
+        services = registry
+
         # メールポーリングジョブ
         scheduler.add_job(
             func=execute_email_polling_job,
+            args=[services],
             trigger=IntervalTrigger(minutes=settings.EMAIL_POLLING_INTERVAL_MINUTES),
             id='email_polling_job',
             name='Email Polling Job',
@@ -29,9 +58,27 @@ def start_scheduler():
             replace_existing=True
         )
 
+        # NotionクライアントDBの差分同期ジョブ（起動直後に1回実行し、以降は定期実行）
+        scheduler.add_job(
+            func=execute_notion_client_sync_job,
+            args=[services],
+            trigger=IntervalTrigger(minutes=settings.NOTION_CLIENT_SYNC_INTERVAL_MINUTES),
+            next_run_time=datetime.now(),
+            id='notion_client_sync_job',
+            name='Notion Client Sync Job',
+            max_instances=1,
+            replace_existing=True
+        )
+
         scheduler.start()
         print(f"スケジューラーを開始しました")
         print(f"メールポーリング間隔: {settings.EMAIL_POLLING_INTERVAL_MINUTES}分")
+        print(f"クライアントデータ同期間隔: {settings.NOTION_CLIENT_SYNC_INTERVAL_MINUTES}分")
+
+        # IMAP IDLEによる新着メールの即時検知
+        if settings.EMAIL_IDLE_ENABLED:
+            idle_listener = EmailIdleListener(on_new_mail=trigger_email_polling_job)
+            idle_listener.start()
 
         atexit.register(lambda: scheduler.shutdown() if scheduler.running else None)
 
@@ -40,7 +87,12 @@ def start_scheduler():
 
 
 def stop_scheduler():
+    global idle_listener
     try:
+        if idle_listener:
+            idle_listener.stop()
+            idle_listener = None
+
         if scheduler.running:
             scheduler.shutdown()
             print("スケジューラーを停止しました")
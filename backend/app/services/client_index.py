@@ -0,0 +1,48 @@
+import unicodedata
+from typing import Dict, Any, Iterable, Optional
+
+
+def normalize_client_name(name: str) -> str:
+    """照合用にクライアント名を正規化（NFKCで全角・半角を統一し、大文字小文字と空白の違いを無視）"""
+    normalized = unicodedata.normalize("NFKC", name or "").casefold()
+    return "".join(normalized.split())
+
+
+class ClientIndex:
+    """クライアント一覧をページID・正規化した名前・略称で引けるようにした索引"""
+
+    def __init__(self, clients: Iterable[Dict[str, Any]] = ()):
+        self.by_id: Dict[str, Dict[str, Any]] = {}
+        self.by_name: Dict[str, Dict[str, Any]] = {}
+        self.by_abbreviation: Dict[str, Dict[str, Any]] = {}
+        for client in clients:
+            self.by_id[client["id"]] = client
+            # 同じ名前・略称が複数ある場合は先に登録したものを優先
+            name_key = normalize_client_name(client["name"])
+            if name_key:
+                self.by_name.setdefault(name_key, client)
+            abbreviation_key = normalize_client_name(client.get("abbreviation", ""))
+            if abbreviation_key:
+                self.by_abbreviation.setdefault(abbreviation_key, client)
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+    def get(self, client_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """ページIDでクライアントを取得（NotionのIDはハイフンの有無を問わない）"""
+        if not client_id:
+            return None
+        client = self.by_id.get(client_id)
+        if client is None and "-" not in client_id and len(client_id) == 32:
+            client = self.by_id.get(
+                f"{client_id[:8]}-{client_id[8:12]}-{client_id[12:16]}-{client_id[16:20]}-{client_id[20:]}"
+            )
+        return client
+
+    def find_by_name(self, name: str) -> Optional[Dict[str, Any]]:
+        """正規化した名前が一致するクライアントを取得"""
+        return self.by_name.get(normalize_client_name(name))
+
+    def find_by_abbreviation(self, abbreviation: str) -> Optional[Dict[str, Any]]:
+        """正規化した略称が一致するクライアントを取得"""
+        return self.by_abbreviation.get(normalize_client_name(abbreviation))
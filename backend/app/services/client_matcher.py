@@ -0,0 +1,167 @@
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, Any, Iterable, List, Optional, Set, Tuple
+
+from app.core import settings
+from app.services.client_index import normalize_client_name
+
+
+# 法人格の表記（NFKC・小文字化した後の形）。名前のどこにあっても取り除く
+_CORPORATE_TERMS = re.compile(
+    r"株式会社|有限会社|合同会社|合資会社|合名会社"
+    r"|(?:一般|公益)?(?:社団|財団)法人|医療法人(?:社団|財団)?|社会福祉法人|学校法人|宗教法人"
+    r"|特定非営利活動法人|npo法人"
+    r"|\((?:株|有|合|資|名|同|社|財|医|学|福)\)"
+)
+# 英語の法人格は末尾の独立した語のみ取り除く（空白・記号を除去する前に適用し、"costco" などの語の一部は残す）
+_ENGLISH_SUFFIXES = re.compile(
+    r"[\s,.]*\b(?:co\.?\s*,?\s*ltd|incorporated|inc|corporation|corp|limited|ltd|llc|k\.?k|co)\.?\s*$"
+)
+
+
+def _katakana(text: str) -> str:
+    """ひらがなをカタカナに揃える"""
+    return "".join(chr(ord(ch) + 0x60) if "ぁ" <= ch <= "ゖ" else ch for ch in text)
+
+
+def normalize_for_matching(name: str) -> str:
+    """照合用の正規化（全角・半角とかなの違い、法人格、空白・記号を無視）"""
+    text = unicodedata.normalize("NFKC", name or "").casefold().strip()
+    text = _ENGLISH_SUFFIXES.sub("", text) or text
+    text = normalize_client_name(text)
+    text = _CORPORATE_TERMS.sub("", text)
+    text = _katakana(text)
+    # 長音符（ー）は残し、句読点・記号・空白を取り除く
+    return "".join(ch for ch in text if unicodedata.category(ch)[0] not in "PSZ")
+
+
+def _ngrams(text: str) -> Set[str]:
+    """文字bigramの集合（1文字の名前はその文字自体）"""
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class ClientMatcher:
+    """クライアント一覧に対する、文字n-gram索引を使ったローカルの曖昧照合
+
+    - 名前と略称をそれぞれ正規化してbigramの転置索引に登録する
+    - 類似度はbigram集合のDice係数（正規化後に完全一致なら1.0、包含関係なら長さの比も考慮）
+    - 共通するbigramがない場合のみ、文字（unigram）集合のDice係数の半分を類似度とする（一致とは判定しない低い値）
+    - 完全一致が1件だけの場合、または最上位が CLIENT_MATCH_ACCEPT_SCORE 以上かつ次点との差が
+      CLIENT_MATCH_AMBIGUITY_MARGIN 以上なら一致と判定し、それ以外はあいまい（Difyで判定）とする
+    - CLIENT_MATCH_REJECT_SCORE を0より大きくした場合のみ、最上位がそれ未満（候補なしを含む）なら該当なしとする
+      （カタカナと漢字など表記が違う名前はスコアが低くなるため、既定ではDifyに判定させる）
+    """
+
+    def __init__(self, clients: Iterable[Dict[str, Any]] = ()):
+        self.clients: List[Dict[str, Any]] = []
+        self._entries: List[Tuple[int, str, Set[str]]] = []
+        self._index: Dict[str, List[int]] = {}
+        self._char_index: Dict[str, List[int]] = {}
+        self._exact: Dict[str, List[int]] = {}
+        for client in clients:
+            client_no = len(self.clients)
+            self.clients.append(client)
+            keys = {normalize_for_matching(client["name"]), normalize_for_matching(client.get("abbreviation", ""))}
+            for key in keys:
+                if not key:
+                    continue
+                entry_no = len(self._entries)
+                grams = _ngrams(key)
+                self._entries.append((client_no, key, grams))
+                self._exact.setdefault(key, []).append(client_no)
+                for gram in grams:
+                    self._index.setdefault(gram, []).append(entry_no)
+                for ch in set(key):
+                    self._char_index.setdefault(ch, []).append(entry_no)
+
+    def __len__(self) -> int:
+        return len(self.clients)
+
+    def candidates(self, vendor: str, limit: int = 5) -> List[Tuple[Dict[str, Any], float]]:
+        """類似度の高い順にクライアントと類似度を返す"""
+        key = normalize_for_matching(vendor)
+        if not key:
+            return []
+        scores: Dict[int, float] = {client_no: 1.0 for client_no in self._exact.get(key, [])}
+
+        grams = _ngrams(key)
+        overlaps = Counter(entry_no for gram in grams for entry_no in self._index.get(gram, ()))
+        for entry_no, overlap in overlaps.items():
+            client_no, entry_key, entry_grams = self._entries[entry_no]
+            score = 2 * overlap / (len(grams) + len(entry_grams))
+            if len(key) >= 2 and len(entry_key) >= 2 and (key in entry_key or entry_key in key):
+                # 支店名・部署名の有無など、一方が他方を含む場合
+                score = max(score, 0.5 + 0.5 * min(len(key), len(entry_key)) / max(len(key), len(entry_key)))
+            if score > scores.get(client_no, 0.0):
+                scores[client_no] = score
+
+        if not scores:
+            # 共通する文字の並びがない場合は、共通する文字の数で順位付けする
+            chars = set(key)
+            char_overlaps = Counter(entry_no for ch in chars for entry_no in self._char_index.get(ch, ()))
+            for entry_no, overlap in char_overlaps.items():
+                client_no, entry_key, _ = self._entries[entry_no]
+                score = overlap / (len(chars) + len(set(entry_key)))
+                if score > scores.get(client_no, 0.0):
+                    scores[client_no] = score
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [(self.clients[client_no], round(score, 4)) for client_no, score in ranked]
+
+    def find_containing(self, text: str) -> Optional[Dict[str, Any]]:
+        """名前に text をそのまま含むクライアントを返す（複数ある場合は先に登録したもの）
+
+        正規化した text の文字bigram（1文字の場合はその文字）をすべて持つ登録名だけを確認する
+        """
+        key = normalize_for_matching(text)
+        if not text or not key:
+            return None
+        index = self._index if len(key) >= 2 else self._char_index
+        postings = [set(index.get(gram, ())) for gram in _ngrams(key)]
+        entry_nos = set.intersection(*postings)
+        for client_no in sorted({self._entries[entry_no][0] for entry_no in entry_nos}):
+            client = self.clients[client_no]
+            if text in client["name"]:
+                return client
+        return None
+
+    def match(self, vendor: str) -> Dict[str, Any]:
+        """vendorを照合し、判定（matched / ambiguous / no_match）と候補を返す"""
+        candidates = self.candidates(vendor)
+        top_score = candidates[0][1] if candidates else 0.0
+        second_score = candidates[1][1] if len(candidates) > 1 else 0.0
+
+        if top_score >= 1.0 and second_score < 1.0:
+            # 正規化後に完全一致するクライアントが1件だけの場合
+            decision = "matched"
+        elif top_score >= settings.CLIENT_MATCH_ACCEPT_SCORE and top_score - second_score >= settings.CLIENT_MATCH_AMBIGUITY_MARGIN:
+            decision = "matched"
+        elif settings.CLIENT_MATCH_REJECT_SCORE > 0 and top_score < settings.CLIENT_MATCH_REJECT_SCORE:
+            decision = "no_match"
+        else:
+            # 候補なし（共通する文字の並びがない）を含め、表記や読みの違いはDifyで判定する
+            decision = "ambiguous"
+
+        return {
+            "decision": decision,
+            "client": candidates[0][0] if decision == "matched" else None,
+            "score": top_score,
+            "candidates": candidates
+        }
+
+
+def to_fuzzy_search_result(match: Dict[str, Any]) -> Dict[str, Any]:
+    """ローカル照合の結果を、Difyの曖昧検索と同じ形式（outputs）に変換"""
+    client: Optional[Dict[str, Any]] = match["client"]
+    if client is None:
+        result = {"id": "null", "name": "該当なし"}
+    else:
+        result = {"id": client["id"], "name": client["name"]}
+    return {
+        "result": result,
+        "source": "local",
+        "score": match["score"]
+    }
@@ -0,0 +1,147 @@
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+from app.core import settings
+from app.core.database import connect_sqlite
+
+
+# vendor_matches のキー（normalize_for_matching の結果）の形式。正規化を変更したら上げ、古いメモを破棄する
+VENDOR_KEY_VERSION = "2"
+
+
+class ClientSnapshotStore:
+    """NotionクライアントDBのローカルスナップショットを保持するSQLiteストア
+
+    - 起動時は load() でディスクから即座に読み込む
+    - 差分同期では last_edited_time が前回の同期位置以降のページだけを反映する
+    - フル同期ではスナップショット全体を置き換える（Notion側で削除されたページを取り除くため）
+    - Difyで解決したvendorとクライアントの対応をメモし、クライアントの追加・変更・削除があった時点で破棄する
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or f"{settings.STORAGE_PATH}/notion_clients.db"
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(self.db_path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS clients ("
+            " id TEXT PRIMARY KEY,"
+            " name TEXT NOT NULL,"
+            " abbreviation TEXT NOT NULL,"
+            " last_edited_time TEXT NOT NULL"
+            ")"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS vendor_matches ("
+            " vendor_key TEXT PRIMARY KEY,"
+            " client_id TEXT NOT NULL,"
+            " client_name TEXT NOT NULL,"
+            " confidence REAL,"
+            " created_at TEXT NOT NULL"
+            ")"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sync_state ("
+            " name TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL"
+            ")"
+        )
+        self._discard_stale_vendor_matches()
+
+    def _discard_stale_vendor_matches(self):
+        """キーの形式が古いvendorのメモを破棄する"""
+        row = self._conn.execute("SELECT value FROM sync_state WHERE name = 'vendor_key_version'").fetchone()
+        if row is not None and row[0] == VENDOR_KEY_VERSION:
+            return
+        self._conn.execute("BEGIN")
+        self._conn.execute("DELETE FROM vendor_matches")
+        self._conn.execute(
+            "INSERT OR REPLACE INTO sync_state (name, value) VALUES ('vendor_key_version', ?)", (VENDOR_KEY_VERSION,)
+        )
+        self._conn.execute("COMMIT")
+
+    def load(self) -> Dict[str, Any]:
+        """スナップショットと同期位置を読み込む"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, name, abbreviation, last_edited_time FROM clients ORDER BY name"
+            ).fetchall()
+            state = dict(self._conn.execute("SELECT name, value FROM sync_state").fetchall())
+        return {
+            "clients": [
+                {"id": row[0], "name": row[1], "abbreviation": row[2], "last_edited_time": row[3]}
+                for row in rows
+            ],
+            "last_edited_time": state.get("last_edited_time"),
+            "last_full_sync": state.get("last_full_sync"),
+            "last_synced_at": state.get("last_synced_at")
+        }
+
+    def apply(self, clients: List[Dict[str, Any]], removed_ids: List[str], full: bool) -> bool:
+        """同期結果を1トランザクションで反映（full=True の場合は既存のスナップショットを置き換える）
+
+        Returns:
+            クライアントの追加・名前や略称の変更・削除があったか（あればvendorのメモを破棄）
+        """
+        now = datetime.now().isoformat()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                existing = {
+                    row[0]: (row[1], row[2])
+                    for row in self._conn.execute("SELECT id, name, abbreviation FROM clients").fetchall()
+                }
+                changed = any(existing.get(c["id"]) != (c["name"], c["abbreviation"]) for c in clients)
+                changed = changed or any(client_id in existing for client_id in removed_ids)
+                if full:
+                    changed = changed or bool(set(existing) - {c["id"] for c in clients})
+                    self._conn.execute("DELETE FROM clients")
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO clients (id, name, abbreviation, last_edited_time) VALUES (?, ?, ?, ?)",
+                    [(c["id"], c["name"], c["abbreviation"], c["last_edited_time"]) for c in clients]
+                )
+                self._conn.executemany("DELETE FROM clients WHERE id = ?", [(client_id,) for client_id in removed_ids])
+                watermark = self._conn.execute("SELECT MAX(last_edited_time) FROM clients").fetchone()[0]
+                state = {"last_synced_at": now}
+                if watermark:
+                    state["last_edited_time"] = watermark
+                if full:
+                    state["last_full_sync"] = now
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO sync_state (name, value) VALUES (?, ?)", list(state.items())
+                )
+                if changed:
+                    # 照合結果が変わり得るため、メモをすべて破棄する
+                    self._conn.execute("DELETE FROM vendor_matches")
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return changed
+
+    def get_vendor_match(self, vendor_key: str) -> Optional[Dict[str, Any]]:
+        """メモ済みのvendorの照合結果を取得（なければNone）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT client_id, client_name, confidence FROM vendor_matches WHERE vendor_key = ?", (vendor_key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"client_id": row[0], "client_name": row[1], "confidence": row[2]}
+
+    def put_vendor_match(self, vendor_key: str, client_id: str, client_name: str, confidence: Optional[float]):
+        """vendorの照合結果をメモ"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO vendor_matches (vendor_key, client_id, client_name, confidence, created_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (vendor_key, client_id, client_name, confidence, datetime.now().isoformat())
+            )
+
+    def count_vendor_matches(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM vendor_matches").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
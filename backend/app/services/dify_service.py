@@ -1,8 +1,13 @@
-import requests
 import aiohttp
 import asyncio
-from typing import Dict, Any, BinaryIO
+import json
+import time
+from typing import Dict, Any, BinaryIO, Optional
 from app.core import settings
+from app.core.adaptive_limiter import AdaptiveLimiter
+from app.core.hedging import Hedger
+from app.core.http_client import ConnectionStats, create_client_session, is_transient_error, is_transient_status
+from app.core.resilience import ResilientEndpoint, TransientHTTPError
 import os
 
 
@@ -14,43 +19,141 @@ class DifyService:
         self.api_token = settings.DIFY_API_TOKEN
         self.api_token_search = settings.DIFY_API_TOKEN_SEARCH
         
+        # 接続を再利用するための共有セッション（初回リクエスト時にイベントループ上で作成）
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.connection_stats = ConnectionStats()
+        self.call_stats: Dict[str, Dict[str, Any]] = {}
+        self.upload_timeout = aiohttp.ClientTimeout(
+            total=settings.DIFY_UPLOAD_TIMEOUT_SECONDS,
+            connect=settings.DIFY_CONNECT_TIMEOUT_SECONDS
+        )
+        self.workflow_timeout = aiohttp.ClientTimeout(
+            total=settings.DIFY_WORKFLOW_TIMEOUT_SECONDS,
+            connect=settings.DIFY_CONNECT_TIMEOUT_SECONDS
+        )
+        # workflows/run の同時実行数（OCRと曖昧検索で共有）。応答時間とタイムアウト・5xxを見て自動で増減する
+        self.workflow_limiter = AdaptiveLimiter(
+            min_limit=settings.DIFY_ADAPTIVE_MIN_CONCURRENCY,
+            max_limit=settings.DIFY_ADAPTIVE_MAX_CONCURRENCY,
+            initial_limit=settings.DIFY_ADAPTIVE_INITIAL_CONCURRENCY,
+            decrease_factor=settings.DIFY_ADAPTIVE_DECREASE_FACTOR
+        )
+        # 一時的な障害の再試行と、停止中の即時失敗（アップロードのやり直しは未使用のファイルが残るだけなので再試行する）
+        self.upload_endpoint = ResilientEndpoint("dify.files_upload", is_transient_error)
+        self.workflow_endpoint = ResilientEndpoint("dify.workflows_run", is_transient_error)
+        # OCRの応答が遅い場合の重複リクエスト（無効の間も応答時間は記録する）
+        self.ocr_hedger = Hedger(
+            "Dify OCR",
+            enabled=settings.DIFY_OCR_HEDGE_ENABLED,
+            percentile=settings.DIFY_OCR_HEDGE_PERCENTILE,
+            budget_percent=settings.DIFY_OCR_HEDGE_BUDGET_PERCENT,
+            min_samples=settings.DIFY_OCR_HEDGE_MIN_SAMPLES,
+            window=settings.DIFY_OCR_HEDGE_WINDOW,
+            has_capacity=self.workflow_limiter.has_capacity
+        )
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = create_client_session(
+                self.connection_stats,
+                limit=settings.DIFY_HTTP_POOL_LIMIT,
+                keepalive_seconds=settings.DIFY_HTTP_KEEPALIVE_SECONDS,
+                dns_cache_seconds=settings.DIFY_HTTP_DNS_CACHE_SECONDS
+            )
+        return self._session
+    
+    async def aclose(self):
+        """共有セッションを閉じる"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+    
+    def get_connection_stats(self) -> Dict[str, Any]:
+        """接続の再利用状況を取得"""
+        return self.connection_stats.to_dict()
+    
+    def get_concurrency_stats(self) -> Dict[str, Any]:
+        """workflows/run の現在の同時実行数の上限（窓）を取得"""
+        return self.workflow_limiter.get_stats()
+    
+    def get_circuit_breaker_stats(self) -> Dict[str, Any]:
+        """エンドポイントごとのサーキットブレーカーの状態を取得"""
+        return {
+            "files_upload": self.upload_endpoint.get_stats(),
+            "workflows_run": self.workflow_endpoint.get_stats()
+        }
+    
+    def get_hedge_stats(self) -> Dict[str, Any]:
+        """OCRのヘッジ（重複リクエスト）の状況を取得"""
+        return self.ocr_hedger.get_stats()
+    
+    async def _run_workflow(self, payload: bytes, api_token: str, target_latency: float, error_label: str, started: Optional[asyncio.Event] = None, hedger: Optional[Hedger] = None) -> Dict[str, Any]:
+        """workflows/run を1回呼び出す（同時実行数の枠の中で実行し、5xx・429は TransientHTTPError を送出）
+        
+        枠を確保して送信を始めた時点で started をセットし、成功した場合は送信から応答までの時間を hedger に記録する
+        """
+        url = f"{self.base_url}/v1/workflows/run"
+        headers = {
+            'Authorization': f'Bearer {api_token}',
+            'Content-Type': 'application/json'
+        }
+        async with self.workflow_limiter.slot(target_latency) as slot:
+            if started is not None:
+                started.set()
+            sent_at = time.monotonic()
+            async with self._get_session().post(url, data=payload, headers=headers, timeout=self.workflow_timeout) as response:
+                if response.status != 200:
+                    if response.status >= 500:
+                        slot.mark_overloaded()
+                    error_text = await response.text()
+                    message = f"{error_label}: {response.status} {response.reason} - {error_text}"
+                    if is_transient_status(response.status):
+                        raise TransientHTTPError(response.status, message)
+                    raise Exception(message)
+                
+                response_data = await response.json()
+            if hedger is not None:
+                hedger.record(time.monotonic() - sent_at)
+            return response_data
+        
     async def upload_file(self, file_path: str) -> str:
         """ファイルをDifyにアップロード"""
         try:
-            url = f"{self.base_url}/v1/files/upload"
-            
-            # ファイルを読み込み
-            with open(file_path, 'rb') as file:
-                # FormDataを作成
-                data = aiohttp.FormData()
-                data.add_field('file', file, filename=os.path.basename(file_path))
-                data.add_field('user', 'fax-ocr-user')
-                
-                headers = {
-                    'Authorization': f'Bearer {self.api_token}'
-                }
-                
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(url, data=data, headers=headers) as response:
-                        if response.status not in [200, 201]:
-                            error_text = await response.text()
-                            raise Exception(f"ファイルアップロードエラー: {response.status} {response.reason} - {error_text}")
-                        
-                        response_data = await response.json()
-                        print(' === Dify file upload response === ')
-                        print('Uploaded file data:', response_data)
-                        
-                        return response_data.get('id')
-                        
+            return await self.upload_endpoint.call(self._upload_file_once, file_path)
         except Exception as e:
             print(f"ファイルアップロードでエラーが発生しました: {e}")
             raise e
     
+    async def _upload_file_once(self, file_path: str) -> str:
+        url = f"{self.base_url}/v1/files/upload"
+        
+        # ファイルを読み込み
+        with open(file_path, 'rb') as file:
+            # FormDataを作成
+            data = aiohttp.FormData()
+            data.add_field('file', file, filename=os.path.basename(file_path))
+            data.add_field('user', 'fax-ocr-user')
+            
+            headers = {
+                'Authorization': f'Bearer {self.api_token}'
+            }
+            
+            async with self._get_session().post(url, data=data, headers=headers, timeout=self.upload_timeout) as response:
+                if response.status not in [200, 201]:
+                    error_text = await response.text()
+                    message = f"ファイルアップロードエラー: {response.status} {response.reason} - {error_text}"
+                    if is_transient_status(response.status):
+                        raise TransientHTTPError(response.status, message)
+                    raise Exception(message)
+                
+                response_data = await response.json()
+                print(' === Dify file upload response === ')
+                print('Uploaded file data:', response_data)
+                
+                return response_data.get('id')
+    
     async def process_ocr(self, file_id: str, file_type: str = "document") -> Dict[str, Any]:
         """アップロードされたファイルのOCR処理をDifyで実行"""
         try:
-            url = f"{self.base_url}/v1/workflows/run"
-            
             request_body = {
                 "inputs": {
                     "img": {
@@ -62,26 +165,19 @@ class DifyService:
                 "response_mode": "blocking",
                 "user": "fax-ocr-user"
             }
+            payload = json.dumps(request_body, ensure_ascii=False).encode('utf-8')
             
-            headers = {
-                'Authorization': f'Bearer {self.api_token}',
-                'Content-Type': 'application/json'
-            }
+            response_data = await self.ocr_hedger.run(lambda started: self.workflow_endpoint.call(
+                self._run_workflow, payload, self.api_token, settings.DIFY_OCR_TARGET_LATENCY_SECONDS, "ワークフロー実行エラー",
+                started=started, hedger=self.ocr_hedger
+            ))
+            print(' === Dify OCR processing response === ')
+            print(response_data)
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=request_body, headers=headers) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        raise Exception(f"ワークフロー実行エラー: {response.status} {response.reason} - {error_text}")
-                    
-                    response_data = await response.json()
-                    print(' === Dify OCR processing response === ')
-                    print(response_data)
-                    
-                    # outputsを取得
-                    outputs = response_data.get('data', {}).get('outputs') or response_data.get('outputs', {})
-                    
-                    return outputs
+            # outputsを取得
+            outputs = response_data.get('data', {}).get('outputs') or response_data.get('outputs', {})
+            
+            return outputs
                     
         except Exception as e:
             print(f"OCR処理でエラーが発生しました: {e}")
@@ -91,13 +187,15 @@ class DifyService:
             }
     
     async def search_client_fuzzy(self, ocr_client_info: str, notion_clients: list) -> Dict[str, Any]:
-        """OCR結果のクライアント情報とNotionクライアントDBの情報を使用してDifyで曖昧検索を実行"""
+        """OCR結果のクライアント情報とNotionクライアントDBの情報を使用してDifyで曖昧検索を実行
+        
+        notion_clients には事前に絞り込んだ候補のみを渡す。送信サイズと応答時間は呼び出しごとに記録する
+        """
+        started = time.perf_counter()
+        payload_bytes = 0
         try:
-            url = f"{self.base_url}/v1/workflows/run"
-            
             # Difyワークフローに送信するデータ
             # notion_clientsをJSON文字列に変換
-            import json
             notion_clients_str = json.dumps(notion_clients, ensure_ascii=False)
             
             request_body = {
@@ -108,26 +206,19 @@ class DifyService:
                 "response_mode": "blocking",
                 "user": "fax-ocr-fuzzy-search"
             }
+            payload = json.dumps(request_body, ensure_ascii=False).encode('utf-8')
+            payload_bytes = len(payload)
             
-            headers = {
-                'Authorization': f'Bearer {self.api_token_search}',
-                'Content-Type': 'application/json'
-            }
-
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=request_body, headers=headers) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        raise Exception(f"曖昧検索エラー: {response.status} {response.reason} - {error_text}")
-                    
-                    response_data = await response.json()
-                    print(' === Dify fuzzy search response === ')
-                    print(response_data)
-                    
-                    # outputsを取得
-                    outputs = response_data.get('data', {}).get('outputs') or response_data.get('outputs', {})
-                    
-                    return outputs
+            response_data = await self.workflow_endpoint.call(
+                self._run_workflow, payload, self.api_token_search, settings.DIFY_SEARCH_TARGET_LATENCY_SECONDS, "曖昧検索エラー"
+            )
+            print(' === Dify fuzzy search response === ')
+            print(response_data)
+            
+            # outputsを取得
+            outputs = response_data.get('data', {}).get('outputs') or response_data.get('outputs', {})
+            
+            return outputs
                     
         except Exception as e:
             print(f"曖昧検索でエラーが発生しました: {e}")
@@ -135,3 +226,33 @@ class DifyService:
                 "status": "error",
                 "message": f"Fuzzy search failed: {str(e)}"
             }
+        finally:
+            latency_ms = (time.perf_counter() - started) * 1000
+            self._record_call("search_client_fuzzy", payload_bytes, latency_ms)
+            print(f"Dify曖昧検索: 候補{len(notion_clients)}件 / 送信{payload_bytes}バイト / {latency_ms:.0f}ms")
+    
+    def _record_call(self, name: str, payload_bytes: int, latency_ms: float):
+        stats = self.call_stats.setdefault(name, {
+            "calls": 0,
+            "total_payload_bytes": 0,
+            "total_latency_ms": 0.0,
+            "last_payload_bytes": 0,
+            "last_latency_ms": 0.0
+        })
+        stats["calls"] += 1
+        stats["total_payload_bytes"] += payload_bytes
+        stats["total_latency_ms"] += latency_ms
+        stats["last_payload_bytes"] = payload_bytes
+        stats["last_latency_ms"] = round(latency_ms, 1)
+    
+    def get_call_stats(self) -> Dict[str, Any]:
+        """ワークフロー呼び出しごとの送信サイズと応答時間の集計を取得"""
+        return {
+            name: {
+                **stats,
+                "total_latency_ms": round(stats["total_latency_ms"], 1),
+                "avg_payload_bytes": round(stats["total_payload_bytes"] / stats["calls"]) if stats["calls"] else 0,
+                "avg_latency_ms": round(stats["total_latency_ms"] / stats["calls"], 1) if stats["calls"] else 0.0
+            }
+            for name, stats in self.call_stats.items()
+        }
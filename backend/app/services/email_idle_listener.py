@@ -0,0 +1,148 @@
+import imaplib
+import threading
+from typing import Callable, Optional
+
+from app.core import settings
+
+
+def _is_exists(line: bytes) -> bool:
+    """"* 12 EXISTS" のような新着の通知かどうか"""
+    return line.startswith(b"*") and line.upper().endswith(b"EXISTS")
+
+
+class EmailIdleListener:
+    """IMAP IDLEでメールボックスを監視し、新着（EXISTS）を検知したらコールバックを呼び出す"""
+
+    def __init__(self, on_new_mail: Callable[[], None]):
+        self.on_new_mail = on_new_mail
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._mail: Optional[imaplib.IMAP4_SSL] = None
+        self._idle_count = 0
+
+    def start(self):
+        """監視スレッドを開始"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="email-idle-listener", daemon=True)
+        self._thread.start()
+        print("IMAP IDLEリスナーを開始しました")
+
+    def stop(self):
+        """監視スレッドを停止"""
+        self._stop_event.set()
+        mail = self._mail
+        if mail is not None:
+            try:
+                # ブロック中の受信を解除するためソケットを閉じる
+                mail.shutdown()
+            except Exception:
+                pass
+        if self._thread:
+            self._thread.join(timeout=10)
+        print("IMAP IDLEリスナーを停止しました")
+
+    def _run(self):
+        retry_delay = 5
+        while not self._stop_event.is_set():
+            try:
+                self._mail = imaplib.IMAP4_SSL(settings.GMAIL_IMAP_SERVER, settings.GMAIL_IMAP_PORT)
+                self._mail.login(settings.GMAIL_EMAIL, settings.GMAIL_PASSWORD)
+                if 'IDLE' not in self._mail.capabilities:
+                    print("IMAPサーバーがIDLEに対応していないため、インターバルポーリングのみで動作します")
+                    return
+                self._mail.select(settings.EMAIL_MAILBOX, readonly=True)
+                retry_delay = 5
+
+                while not self._stop_event.is_set():
+                    if self._idle(self._mail):
+                        print("IMAP IDLE: 新着メールを検知しました")
+                        self.on_new_mail()
+                    else:
+                        # タイムアウト前にIDLEを再発行（NOOPで接続を確認）
+                        self._mail.noop()
+
+            except Exception as e:
+                if self._stop_event.is_set():
+                    break
+                print(f"IMAP IDLEリスナーでエラーが発生しました: {e}（{retry_delay}秒後に再接続します）")
+                self._stop_event.wait(retry_delay)
+                retry_delay = min(retry_delay * 2, 300)
+            finally:
+                self._logout()
+
+    def _idle(self, mail: imaplib.IMAP4_SSL) -> bool:
+        """IDLEを1サイクル実行し、EXISTSを受信した場合はTrueを返す
+
+        サーバー側の29分タイムアウトより前に EMAIL_IDLE_RENEW_MINUTES でIDLEを終了する
+        """
+        renew_seconds = settings.EMAIL_IDLE_RENEW_MINUTES * 60
+        if hasattr(mail, "idle"):
+            # Python 3.14以降は imaplib のIDLEを使う（ブロックを抜けるとDONEを送る）
+            with mail.idle(duration=renew_seconds) as idler:
+                for response_type, _ in idler:
+                    if response_type == "EXISTS":
+                        return True
+            return False
+
+        self._idle_count += 1
+        tag = f"IDLE{self._idle_count}".encode()
+        mail.send(tag + b" IDLE\r\n")
+
+        # 継続応答（+）でIDLEの開始を確認する（先にタグ付き応答が返った場合は拒否された）
+        has_new_mail = False
+        while True:
+            line = self._readline(mail)
+            if line.startswith(b"+"):
+                break
+            if line.startswith(tag + b" "):
+                raise imaplib.IMAP4.error(f"IDLEが拒否されました: {line.decode(errors='ignore')}")
+            has_new_mail = has_new_mail or _is_exists(line)
+
+        # 受信はimaplibのバッファ付きリーダーで待ち、DONEは新着の検知時か更新時刻にタイマーから送る
+        done = threading.Event()
+        done_lock = threading.Lock()
+
+        def send_done():
+            with done_lock:
+                if done.is_set():
+                    return
+                done.set()
+                try:
+                    mail.send(b"DONE\r\n")
+                except OSError:
+                    # 切断済み（stop() による shutdown など）の場合は読み取り側でエラーになる
+                    pass
+
+        timer = threading.Timer(renew_seconds, send_done)
+        timer.daemon = True
+        timer.start()
+        try:
+            if has_new_mail:
+                send_done()
+            # DONEに対するタグ付き応答まで読み切り、以降のコマンドの応答と混ざらないようにする
+            while True:
+                line = self._readline(mail)
+                if line.startswith(tag + b" "):
+                    return has_new_mail
+                if _is_exists(line):
+                    has_new_mail = True
+                    send_done()
+        finally:
+            timer.cancel()
+
+    def _readline(self, mail: imaplib.IMAP4_SSL) -> bytes:
+        line = mail.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("IDLE中に接続が切断されました")
+        return line.rstrip(b"\r\n")
+
+    def _logout(self):
+        mail, self._mail = self._mail, None
+        if mail is None:
+            return
+        try:
+            mail.logout()
+        except Exception:
+            pass
@@ -1,18 +1,59 @@
-import imaplib
-import email
+import asyncio
+import hashlib
 import os
 import json
+import re
 from datetime import datetime
-from typing import List, Dict, Any, Set
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
 import aiofiles
 from email.header import decode_header
 from app.core import settings
+from app.services.imap_client import AsyncImapClient
+from app.services.mime_stream import IncrementalDecoder, extract_message_file
+from app.services.processed_store import ProcessedMessageStore
+from app.services.work_queue import DocumentWorkQueue
+from app.services.imap_fetch import (
+    compress_uid_set,
+    decode_part_payload,
+    format_envelope_address,
+    iter_body_parts,
+    parse_fetch_response,
+)
+
+
+def _message_id_key(message_id) -> Optional[str]:
+    """Message-IDから、UIDVALIDITYに依存しない処理済みキー（msgid:<...>）を作る"""
+    if isinstance(message_id, bytes):
+        message_id = message_id.decode('utf-8', errors='ignore')
+    message_id = (message_id or "").strip()
+    return f"msgid:{message_id}" if message_id else None
+
+
+class _HashingFile:
+    """書き込んだ内容のSHA-256を計算しながらファイルに書き出す"""
+    
+    def __init__(self, path: str, on_close: Callable[[str], None]):
+        self._file = open(path, 'wb')
+        self._hash = hashlib.sha256()
+        self._on_close = on_close
+    
+    def write(self, data: bytes):
+        self._hash.update(data)
+        self._file.write(data)
+    
+    def close(self):
+        self._file.close()
+        self._on_close(self._hash.hexdigest())
 
 
 class EmailService:
     def __init__(self):
         self.processed_ids_file = f"{settings.STORAGE_PATH}/processed_email_ids.json"
+        self.processed_store = ProcessedMessageStore(legacy_json_path=self.processed_ids_file)
         self.last_poll_time_file = f"{settings.STORAGE_PATH}/last_poll_time.json"
+        self.sync_state_file = f"{settings.STORAGE_PATH}/imap_sync_state.json"
+        self.imap_client = AsyncImapClient()
+        self.work_queue = DocumentWorkQueue()
     
     def _decode_mime_words(self, s):
         """MIME エンコードされた文字列をデコード"""
@@ -43,37 +84,22 @@ class EmailService:
         
         return ''.join(decoded_parts)
     
-    async def _load_processed_ids(self) -> Set[str]:
-        """処理済みメールIDを読み込み"""
-        try:
-            if os.path.exists(self.processed_ids_file):
-                async with aiofiles.open(self.processed_ids_file, 'r') as f:
-                    content = await f.read()
-                    data = json.loads(content)
-                    return set(data.get('processed_ids', []))
-            return set()
-        except Exception as e:
-            print(f"処理済みID読み込みエラー: {e}")
-            return set()
+    async def _is_processed(self, email_id: str) -> bool:
+        """処理済みかどうかを確認"""
+        return await asyncio.to_thread(self.processed_store.contains, email_id)
     
-    async def _save_processed_ids(self, processed_ids: Set[str]):
-        """処理済みメールIDを保存"""
+    async def _add_processed_id(self, email_id: str, message_id=None):
+        """処理済みIDを追加（Message-IDがあれば、UIDVALIDITYが変わっても照合できるようにそのキーも追加）"""
         try:
-            os.makedirs(settings.STORAGE_PATH, exist_ok=True)
-            data = {
-                'processed_ids': list(processed_ids),
-                'last_updated': datetime.now().isoformat()
-            }
-            async with aiofiles.open(self.processed_ids_file, 'w') as f:
-                await f.write(json.dumps(data, indent=2))
+            key = _message_id_key(message_id)
+            await asyncio.to_thread(self.processed_store.add_many, [email_id, key] if key else [email_id])
         except Exception as e:
             print(f"処理済みID保存エラー: {e}")
     
-    async def _add_processed_id(self, email_id: str):
-        """処理済みIDを追加"""
-        processed_ids = await self._load_processed_ids()
-        processed_ids.add(email_id)
-        await self._save_processed_ids(processed_ids)
+    async def _enqueue_documents(self, email_id: str, pdf_files: List[str], pdf_hashes: Dict[str, str], email_info: Dict[str, Any]):
+        """保存したPDFをワークキューに登録（処理済みIDより先に記録し、取りこぼしを防ぐ）"""
+        if pdf_files:
+            await asyncio.to_thread(self.work_queue.enqueue, email_id, pdf_files, pdf_hashes, email_info)
     
     async def _load_last_poll_time(self) -> datetime:
         """前回のポーリング時刻を読み込み"""
@@ -104,45 +130,185 @@ class EmailService:
         except Exception as e:
             print(f"前回ポーリング時刻保存エラー: {e}")
         
-    async def poll_emails(self) -> Dict[str, Any]:
-        """メールをポーリングして新しいメールを処理"""
+    async def _load_sync_state(self) -> Dict[str, Any]:
+        """メールボックスごとのUID同期状態（UIDVALIDITY・最終UID）を読み込み"""
         try:
-            current_time = datetime.now()
-            
-            # 前回のポーリング時刻を読み込み
-            last_poll_time = await self._load_last_poll_time()
-            
-            # 処理済みIDを読み込み
-            processed_ids = await self._load_processed_ids()
-            
-            # Gmail接続
-            mail = imaplib.IMAP4_SSL(settings.GMAIL_IMAP_SERVER, settings.GMAIL_IMAP_PORT)
-            mail.login(settings.GMAIL_EMAIL, settings.GMAIL_PASSWORD)
-            mail.select('inbox')
+            if os.path.exists(self.sync_state_file):
+                async with aiofiles.open(self.sync_state_file, 'r') as f:
+                    content = await f.read()
+                    data = json.loads(content)
+                    return data.get('mailboxes', {})
+            return {}
+        except Exception as e:
+            print(f"UID同期状態読み込みエラー: {e}")
+            return {}
+    
+    async def _save_sync_state(self, mailbox: str, uidvalidity: str, last_uid: int):
+        """メールボックスのUID同期状態を保存"""
+        try:
+            os.makedirs(settings.STORAGE_PATH, exist_ok=True)
+            mailboxes = await self._load_sync_state()
+            mailboxes[mailbox] = {
+                'uidvalidity': uidvalidity,
+                'last_uid': last_uid,
+                'updated_at': datetime.now().isoformat()
+            }
+            async with aiofiles.open(self.sync_state_file, 'w') as f:
+                await f.write(json.dumps({'mailboxes': mailboxes}, indent=2))
+        except Exception as e:
+            print(f"UID同期状態保存エラー: {e}")
+    
+    async def _get_mailbox_uid_info(self, mail, mailbox: str) -> Tuple[str, int]:
+        """SELECT応答からUIDVALIDITYとUIDNEXTを取得（取得できない場合はSTATUSで問い合わせ）"""
+        info = {}
+        for key in ('UIDVALIDITY', 'UIDNEXT'):
+            typ, data = mail.response(key)
+            if data and data[0]:
+                info[key] = int(data[0])
+        
+        if len(info) < 2:
+            status, data = await mail.status(mailbox, '(UIDVALIDITY UIDNEXT)')
+            if status == 'OK' and data and data[0]:
+                for key, value in re.findall(rb'(UIDVALIDITY|UIDNEXT) (\d+)', data[0]):
+                    info[key.decode()] = int(value)
+        
+        if 'UIDVALIDITY' not in info:
+            raise Exception(f"UIDVALIDITYを取得できませんでした: {mailbox}")
+        return str(info['UIDVALIDITY']), info.get('UIDNEXT', 1)
+    
+    async def _search_new_uids(self, mail, mailbox: str, uidvalidity: str, since_date: str) -> Tuple[List[int], Optional[int]]:
+        """前回同期以降の新着UIDを検索
+        
+        Returns:
+            (昇順のUIDリスト, 前回の最終UID（フルリシンクの場合はNone）)
+        """
+        mailboxes = await self._load_sync_state()
+        state = mailboxes.get(mailbox)
+        
+        if state and str(state.get('uidvalidity')) == uidvalidity:
+            last_uid = int(state.get('last_uid', 0))
+            print(f"UID同期: UIDVALIDITY={uidvalidity}, 最終UID={last_uid}")
+            print(f"検索条件: UID {last_uid + 1}:*")
+            status, messages = await mail.uid('search', None, f'UID {last_uid + 1}:*')
+            # "n:*" は新着がない場合でも最大UIDのメールを返すため、最終UID以下は除外
+            uids = [int(uid) for uid in messages[0].split() if int(uid) > last_uid]
+            return sorted(uids), last_uid
+        
+        if state:
+            print(f"UIDVALIDITYが変更されました ({state.get('uidvalidity')} -> {uidvalidity})。フルリシンクを行います")
+        else:
+            print("UID同期状態がないため、フルリシンクを行います")
+            await self._migrate_sequence_ids(mail, uidvalidity, since_date)
+        print(f"検索条件: SINCE {since_date}")
+        status, messages = await mail.uid('search', None, f'SINCE {since_date}')
+        uids = [int(uid) for uid in messages[0].split()]
+        if state:
+            await self._migrate_message_ids(mail, uidvalidity, uids)
+        return sorted(uids), None
+    
+    async def _migrate_sequence_ids(self, mail, uidvalidity: str, since_date: str):
+        """シーケンス番号で記録された旧形式の処理済みIDを、UID形式（UIDVALIDITY_UID）に引き継ぐ
+        
+        UID同期を初めて行う際、SINCEで見つかったメールのシーケンス番号をFETCH (UID)でUIDに変換し、
+        旧形式のIDが処理済みのものはUID形式でも処理済みとして記録する（Notionへの二重登録を防ぐ）
+        """
+        status, messages = await mail.search(None, f'SINCE {since_date}')
+        sequence_ids = [seq.decode() for seq in messages[0].split()] if status == 'OK' and messages[0] else []
+        processed = await asyncio.to_thread(self.processed_store.filter_processed, sequence_ids)
+        if not processed:
+            return
+        
+        status, data = await mail.fetch(",".join(sorted(processed, key=int)), '(UID)')
+        uid_ids = []
+        for item in data if status == 'OK' else []:
+            line = item[0] if isinstance(item, tuple) else item
+            match = re.match(rb'(\d+) \(UID (\d+)\)', line or b'')
+            if match and match.group(1).decode() in processed:
+                uid_ids.append(f"{uidvalidity}_{int(match.group(2))}")
+        await asyncio.to_thread(self.processed_store.add_many, uid_ids)
+        print(f"旧形式（シーケンス番号）の処理済みIDをUID形式に引き継ぎました: {len(uid_ids)}件")
+    
+    async def _migrate_message_ids(self, mail, uidvalidity: str, uids: List[int]):
+        """UIDVALIDITYの変更後、処理済みのMessage-IDを持つメールを新しいUIDでも処理済みとして記録する
+        
+        UIDは振り直されるため、SINCEで見つかったメールのMessage-IDを一括取得して照合する（Notionへの二重登録を防ぐ）
+        """
+        if not uids:
+            return
+        status, data = await mail.uid('fetch', compress_uid_set(uids), '(UID BODY.PEEK[HEADER.FIELDS (MESSAGE-ID)])')
+        if status != 'OK':
+            print(f"Message-IDの取得に失敗したため、処理済みIDを引き継げませんでした: {status}")
+            return
+        
+        uid_by_key = {}
+        for fields in parse_fetch_response(data).values():
+            header = fields.get('BODY[HEADER.FIELDS (MESSAGE-ID)]') or b""
+            match = re.search(rb'^message-id:\s*(.+?)\s*$', header, re.IGNORECASE | re.MULTILINE)
+            key = _message_id_key(match.group(1)) if match else None
+            if key and 'UID' in fields:
+                uid_by_key[key] = int(fields['UID'])
+        
+        processed = await asyncio.to_thread(self.processed_store.filter_processed, list(uid_by_key))
+        uid_ids = [f"{uidvalidity}_{uid_by_key[key]}" for key in processed]
+        await asyncio.to_thread(self.processed_store.add_many, uid_ids)
+        print(f"Message-IDで照合した処理済みIDを新しいUIDVALIDITYに引き継ぎました: {len(uid_ids)}件")
+    
+    async def iter_new_emails(self, summary: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """新しいメールを1件ずつ取得してyieldする
+        
+        メールは取り出された時点で呼び出し側に渡されるため、メールボックス全体の取得完了を待たずに後続処理を開始できる。
+        スキップしたメールや同期情報は summary に記録する（すべて取り出し終えた時点で確定）。
+        """
+        summary = summary if summary is not None else {}
+        current_time = datetime.now()
+        mailbox = settings.EMAIL_MAILBOX
+        use_uid = settings.EMAIL_SYNC_MODE == "uid"
+        skipped_emails = summary.setdefault("skipped_emails", [])
+        summary["processed_count"] = 0
+        
+        # 前回のポーリング時刻を読み込み
+        last_poll_time = await self._load_last_poll_time()
+        summary["sync_mode"] = settings.EMAIL_SYNC_MODE
+        summary["full_resync"] = False
+        summary["poll_time_range"] = {
+            "from": last_poll_time.isoformat(),
+            "to": current_time.isoformat()
+        }
+        
+        # Gmail接続（プールの認証済み接続を再利用し、IMAP I/Oは専用スレッドで実行）
+        async with self.imap_client.connection() as mail:
+            await mail.select(mailbox)
             
             # 前回のポーリング時刻以降のメールを検索
             # IMAPの日付フォーマット: DD-MMM-YYYY (例: 01-Jan-2024)
             since_date = last_poll_time.strftime("%d-%b-%Y")
             print(f"前回ポーリング時刻: {last_poll_time.isoformat()}")
-            print(f"検索条件: SINCE {since_date}")
             
-            status, messages = mail.search(None, f'SINCE {since_date}')
-            email_ids = messages[0].split()
-            
-            # 最新から古い順に並び替え
-            email_ids.reverse()
+            uidvalidity = None
+            if use_uid:
+                # UIDVALIDITYと最終UIDに基づいて新着分のみ取得
+                uidvalidity, uidnext = await self._get_mailbox_uid_info(mail, mailbox)
+                uids, last_uid = await self._search_new_uids(mail, mailbox, uidvalidity, since_date)
+                summary["full_resync"] = last_uid is None
+                if last_uid is None:
+                    # フルリシンク後は現在のメールボックス末尾を基準に新着のみを取得する
+                    last_uid = uidnext - 1
+                # UIDはUIDVALIDITYごとに一意なので、処理済みIDはUIDVALIDITYで名前空間を分ける
+                email_ids = [(str(uid).encode(), f"{uidvalidity}_{uid}") for uid in uids]
+            else:
+                print(f"検索条件: SINCE {since_date}")
+                status, messages = await mail.search(None, f'SINCE {since_date}')
+                # 最新から古い順に並び替え
+                email_ids = [(email_id, email_id.decode()) for email_id in reversed(messages[0].split())]
             
             print(f"検索結果: {len(email_ids)}件のメールが見つかりました")
             
-            processed_emails = []
-            skipped_emails = []
+            pending_ids = []
             consecutive_processed_count = 0
             
-            for email_id in email_ids:
-                email_id_str = email_id.decode()
-                
+            for email_id, email_id_str in email_ids:
                 # 既に処理済みかチェック
-                if email_id_str in processed_ids:
+                if await self._is_processed(email_id_str):
                     consecutive_processed_count += 1
                     skipped_emails.append({
                         "email_id": email_id_str,
@@ -151,7 +317,8 @@ class EmailService:
                     print(f"メールID {email_id_str} は既に処理済みのためスキップします")
                     
                     # 連続して10件処理済みメールが見つかったら、それより古いメールは処理済みと判断して終了
-                    if consecutive_processed_count >= 10:
+                    # （UID同期では新着分のみを昇順で取得するため不要）
+                    if not use_uid and consecutive_processed_count >= 10:
                         print("連続して10件の処理済みメールが見つかったため、ポーリングを終了します")
                         break
                     
@@ -159,123 +326,311 @@ class EmailService:
                 
                 # 新しいメールが見つかったら連続カウントをリセット
                 consecutive_processed_count = 0
+                pending_ids.append((email_id, email_id_str))
+            
+            if use_uid and settings.EMAIL_FETCH_MODE == "structure":
+                # BODYSTRUCTUREを一括取得し、PDFパートのみをダウンロード
+                batch_size = max(settings.EMAIL_FETCH_BATCH_SIZE, 1)
+                for i in range(0, len(pending_ids), batch_size):
+                    async for email_data in self._fetch_emails_structured(mail, pending_ids[i:i + batch_size], skipped_emails):
+                        summary["processed_count"] += 1
+                        yield email_data
+            else:
+                for email_id, email_id_str in pending_ids:
+                    email_data = await self._fetch_email_full(mail, email_id, email_id_str, use_uid)
+                    summary["processed_count"] += 1
+                    yield email_data
+        
+        # UID同期状態を保存（処理したUIDの最大値まで進める）
+        if use_uid:
+            if email_ids:
+                last_uid = max(last_uid, int(email_ids[-1][0]))
+            await self._save_sync_state(mailbox, uidvalidity, last_uid)
+        
+        # ポーリング完了時刻を保存
+        await self._save_last_poll_time(current_time)
+        summary["skipped_count"] = len(skipped_emails)
+    
+    async def poll_emails(self) -> Dict[str, Any]:
+        """メールをポーリングして新しいメールを処理（取得したメールをまとめて返す）"""
+        try:
+            summary: Dict[str, Any] = {}
+            processed_emails = [email_data async for email_data in self.iter_new_emails(summary)]
+            
+            return {
+                "processed_count": len(processed_emails),
+                "skipped_count": summary["skipped_count"],
+                "emails": processed_emails,
+                "skipped_emails": summary["skipped_emails"],
+                "sync_mode": summary["sync_mode"],
+                "full_resync": summary["full_resync"],
+                "poll_time_range": summary["poll_time_range"]
+            }
+            
+        except Exception as e:
+            return {"error": str(e)}
+    
+    async def _stream_section(self, mail, message_id: bytes, section: str, use_uid: bool, write: Callable[[bytes], Awaitable[Any]], offset: int = 0) -> int:
+        """BODY.PEEK[section] を offset バイト目から部分取得で分割ダウンロードし、チャンクごとに write に渡す
+        
+        1回に受信するのは EMAIL_FETCH_CHUNK_SIZE バイトまでなので、パートのサイズに関わらずメモリ使用量は一定
+        
+        Returns:
+            取得した合計バイト数（offset を含む）
+        """
+        chunk_size = self._fetch_chunk_size()
+        while True:
+            item = f'(BODY.PEEK[{section}]<{offset}.{chunk_size}>)'
+            if use_uid:
+                status, data = await mail.uid('fetch', message_id, item)
+            else:
+                status, data = await mail.fetch(message_id, item)
+            if status != 'OK':
+                raise Exception(f"メール取得エラー: {status}")
+            
+            chunk = b""
+            for fields in parse_fetch_response(data).values():
+                chunk = fields.get(f'BODY[{section}]') or chunk
+            await write(chunk)
+            offset += len(chunk)
+            
+            if len(chunk) < chunk_size:
+                return offset
+    
+    def _fetch_chunk_size(self) -> int:
+        return max(settings.EMAIL_FETCH_CHUNK_SIZE, 1024)
+    
+    async def _fetch_email_full(self, mail, email_id: bytes, email_id_str: str, use_uid: bool) -> Dict[str, Any]:
+        """メール全体を分割取得してファイルに保存し、保存したファイルから添付ファイルを抽出"""
+        # メールファイルを保存（受信したチャンクをそのまま書き込む）
+        email_file_path = await self._save_email_file(mail, email_id, email_id_str, use_uid)
+        
+        # PDF添付ファイルを処理（本文の抽出も同じ走査で行う）
+        pdf_files, pdf_hashes, extracted = await asyncio.to_thread(self._process_attachments, email_file_path, email_id_str)
+        
+        # メール情報を抽出
+        email_info = await self._extract_email_info(extracted["headers"], extracted["body"], extracted["body_charset"])
+        
+        # PDFをワークキューに登録してから処理済みIDとして記録
+        await self._enqueue_documents(email_id_str, pdf_files, pdf_hashes, email_info)
+        await self._add_processed_id(email_id_str, extracted["headers"].get("Message-ID"))
+        
+        print(f"メールID {email_id_str} の処理が完了しました")
+        
+        return {
+            "email_id": email_id_str,
+            "subject": email_info["subject"],
+            "from": email_info["from"],
+            "date": email_info["date"],
+            "pdf_files": pdf_files,
+            "pdf_hashes": pdf_hashes,
+            "email_info": email_info
+        }
+    
+    def _is_pdf_part(self, part: Dict[str, Any]) -> bool:
+        """BODYSTRUCTUREのパートがPDF添付ファイルかどうか"""
+        filename = self._decode_mime_words(part["filename"] or "")
+        return part["disposition"] == "attachment" and filename.lower().endswith('.pdf')
+    
+    def _format_envelope_addresses(self, addresses) -> str:
+        """ENVELOPEのアドレスを "表示名 <address>" 形式の文字列に変換"""
+        formatted = []
+        for name, address in format_envelope_address(addresses):
+            name = self._decode_mime_words(name)
+            formatted.append(f"{name} <{address}>" if name else address)
+        return ", ".join(formatted)
+    
+    async def _fetch_emails_structured(self, mail, uid_items: List[Tuple[bytes, str]], skipped_emails: List[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        """BODYSTRUCTUREとENVELOPEをUID範囲で一括取得し、PDFを含むメールのPDFパートのみ取得
+        
+        PDFパートは先頭の EMAIL_FETCH_CHUNK_SIZE バイトをヘッダー・本文と同じFETCHでまとめて取得し、
+        それより大きいパートのみ続きを分割取得する。取得したメールは1件ずつyieldし、スキップしたメールは skipped_emails に追加する
+        """
+        email_id_map = {int(uid): email_id_str for uid, email_id_str in uid_items}
+        if not email_id_map:
+            return
+        
+        # 1回のFETCHで構造とエンベロープを取得
+        uid_set = compress_uid_set(list(email_id_map))
+        status, data = await mail.uid('fetch', uid_set, '(UID BODYSTRUCTURE ENVELOPE)')
+        if status != 'OK':
+            raise Exception(f"BODYSTRUCTURE取得エラー: {status}")
+        
+        structures = {}
+        for fields in parse_fetch_response(data).values():
+            if 'UID' in fields and 'BODYSTRUCTURE' in fields:
+                structures[int(fields['UID'])] = fields
+        
+        # 取得対象のセクション構成ごとにメールをまとめる
+        groups: Dict[Tuple[str, ...], List[int]] = {}
+        message_parts = {}
+        for uid in sorted(email_id_map):
+            email_id_str = email_id_map[uid]
+            fields = structures.get(uid)
+            if fields is None:
+                # 検索後に削除されたメールなど
+                skipped_emails.append({"email_id": email_id_str, "reason": "not_found"})
+                continue
+            
+            parts = iter_body_parts(fields['BODYSTRUCTURE'])
+            pdf_parts = [part for part in parts if self._is_pdf_part(part)]
+            if not pdf_parts:
+                print(f"メールID {email_id_str} にはPDFファイルが含まれていないためスキップします")
+                envelope = fields.get('ENVELOPE') or []
+                await self._add_processed_id(email_id_str, envelope[9] if len(envelope) > 9 else None)
+                skipped_emails.append({"email_id": email_id_str, "reason": "no_pdf"})
+                continue
+            
+            text_part = next(
+                (part for part in parts if part["content_type"] == "text/plain" and part["disposition"] != "attachment"),
+                None
+            )
+            message_parts[uid] = (text_part, pdf_parts, fields.get('ENVELOPE'))
+            text_sections = (text_part["section"],) if text_part else ()
+            pdf_sections = tuple(part["section"] for part in pdf_parts)
+            groups.setdefault((text_sections, pdf_sections), []).append(uid)
+        
+        os.makedirs(settings.PDF_STORAGE_PATH, exist_ok=True)
+        chunk_size = self._fetch_chunk_size()
+        
+        # 同じセクション構成のメールはヘッダー・本文・各PDFパートの先頭チャンクをまとめて取得（PEEKで既読にしない）
+        for (text_sections, pdf_sections), uids in groups.items():
+            # 本文は EMAIL_BODY_MAX_BYTES までに切り詰めて取得（fullモードの本文と同じ上限）
+            items = ['UID', 'BODY.PEEK[HEADER]'] + [f'BODY.PEEK[{section}]<0.{settings.EMAIL_BODY_MAX_BYTES}>' for section in text_sections]
+            items += [f'BODY.PEEK[{section}]<0.{chunk_size}>' for section in pdf_sections]
+            status, data = await mail.uid('fetch', compress_uid_set(uids), f"({' '.join(items)})")
+            if status != 'OK':
+                raise Exception(f"PDFパート取得エラー: {status}")
+            
+            bodies = {}
+            for fields in parse_fetch_response(data).values():
+                if 'UID' in fields:
+                    bodies.setdefault(int(fields['UID']), {}).update(fields)
+            
+            for uid in uids:
+                email_id_str = email_id_map[uid]
+                fields = bodies.get(uid, {})
+                text_part, pdf_parts, envelope = message_parts[uid]
+                envelope = envelope or []
                 
-                # メール取得
-                status, msg_data = mail.fetch(email_id, '(RFC822)')
-                email_message = email.message_from_bytes(msg_data[0][1])
+                body = ""
+                if text_part:
+                    raw_body = decode_part_payload(fields.get(f'BODY[{text_part["section"]}]'), text_part["encoding"])
+                    body = self._decode_body(raw_body, text_part["charset"])
                 
-                # メール情報を抽出
-                email_info = await self._extract_email_info(email_message)
+                email_info = {
+                    "subject": self._decode_mime_words(envelope[1].decode('utf-8', errors='ignore') if len(envelope) > 1 and envelope[1] else ""),
+                    "from": self._format_envelope_addresses(envelope[2] if len(envelope) > 2 else None),
+                    "to": self._format_envelope_addresses(envelope[5] if len(envelope) > 5 else None),
+                    "date": envelope[0].decode('utf-8', errors='ignore') if envelope and envelope[0] else "",
+                    "body": body,
+                    "received_at": datetime.now().isoformat()
+                }
+                
+                # ヘッダー部分をメールファイルとして保存
+                os.makedirs(settings.EMAIL_STORAGE_PATH, exist_ok=True)
+                async with aiofiles.open(f"{settings.EMAIL_STORAGE_PATH}/{email_id_str}.eml", 'wb') as f:
+                    await f.write(fields.get('BODY[HEADER]') or b"")
                 
-                # メールファイルを保存
-                await self._save_email_file(email_id_str, email_message)
+                pdf_files = []
+                pdf_hashes = {}
+                for part in pdf_parts:
+                    filename = self._decode_mime_words(part["filename"])
+                    pdf_path = f"{settings.PDF_STORAGE_PATH}/{email_id_str}_{filename}"
+                    # PDFパートはチャンクごとにデコードしてファイルへ書き込む（同時にSHA-256を計算）
+                    decoder = IncrementalDecoder(part["encoding"])
+                    pdf_hash = hashlib.sha256()
+                    async with aiofiles.open(pdf_path, 'wb') as f:
+                        async def write_decoded(chunk: bytes, f=f, decoder=decoder, pdf_hash=pdf_hash):
+                            decoded = decoder.decode(chunk)
+                            pdf_hash.update(decoded)
+                            await f.write(decoded)
+                        first_chunk = fields.get(f'BODY[{part["section"]}]') or b""
+                        await write_decoded(first_chunk)
+                        # 先頭チャンクがちょうど上限サイズで返ったパートのみ、続きを分割取得する
+                        if len(first_chunk) >= chunk_size:
+                            await self._stream_section(mail, str(uid).encode(), part["section"], True, write_decoded, offset=len(first_chunk))
+                        tail = decoder.flush()
+                        pdf_hash.update(tail)
+                        await f.write(tail)
+                    pdf_files.append(pdf_path)
+                    pdf_hashes[pdf_path] = pdf_hash.hexdigest()
                 
-                # PDF添付ファイルを処理
-                pdf_files = await self._process_attachments(email_message, email_id_str)
+                # PDFをワークキューに登録してから処理済みIDとして記録
+                await self._enqueue_documents(email_id_str, pdf_files, pdf_hashes, email_info)
+                await self._add_processed_id(email_id_str, envelope[9] if len(envelope) > 9 else None)
                 
-                # 処理済みIDとして記録
-                await self._add_processed_id(email_id_str)
+                print(f"メールID {email_id_str} の処理が完了しました（PDF {len(pdf_files)}件）")
                 
-                processed_emails.append({
+                yield {
                     "email_id": email_id_str,
                     "subject": email_info["subject"],
                     "from": email_info["from"],
                     "date": email_info["date"],
                     "pdf_files": pdf_files,
+                    "pdf_hashes": pdf_hashes,
                     "email_info": email_info
-                })
-                
-                print(f"メールID {email_id_str} の処理が完了しました")
-            
-            mail.close()
-            mail.logout()
-            
-            # ポーリング完了時刻を保存
-            await self._save_last_poll_time(current_time)
-            
-            return {
-                "processed_count": len(processed_emails),
-                "skipped_count": len(skipped_emails),
-                "emails": processed_emails,
-                "skipped_emails": skipped_emails,
-                "poll_time_range": {
-                    "from": last_poll_time.isoformat(),
-                    "to": current_time.isoformat()
                 }
-            }
-            
-        except Exception as e:
-            return {"error": str(e)}
     
-    async def _extract_email_info(self, email_message) -> Dict[str, Any]:
-        """メールから情報を抽出"""
+    def _decode_body(self, body: bytes, charset: Optional[str]) -> str:
+        """本文のバイト列を文字列にデコード"""
+        try:
+            return body.decode(charset or 'utf-8', errors='ignore')
+        except LookupError:
+            return body.decode('utf-8', errors='ignore')
+    
+    async def _extract_email_info(self, email_headers, body: bytes, charset: Optional[str]) -> Dict[str, Any]:
+        """メールのヘッダーと本文から情報を抽出"""
         # MIMEエンコードされた文字列をデコード
-        subject_raw = email_message.get("Subject", "")
-        from_raw = email_message.get("From", "")
-        to_raw = email_message.get("To", "")
-        
-        # メール本文を抽出
-        body = ""
-        if email_message.is_multipart():
-            for part in email_message.walk():
-                content_type = part.get_content_type()
-                content_disposition = str(part.get("Content-Disposition"))
-                
-                # テキスト部分を抽出（添付ファイルは除外）
-                if content_type == "text/plain" and "attachment" not in content_disposition:
-                    try:
-                        body_part = part.get_payload(decode=True)
-                        charset = part.get_content_charset() or 'utf-8'
-                        body = body_part.decode(charset, errors='ignore')
-                        break  # プレーンテキストが見つかったら終了
-                    except Exception as e:
-                        print(f"メール本文デコードエラー: {e}")
-        else:
-            # シングルパートメッセージの場合
-            try:
-                body_part = email_message.get_payload(decode=True)
-                charset = email_message.get_content_charset() or 'utf-8'
-                body = body_part.decode(charset, errors='ignore')
-            except Exception as e:
-                print(f"メール本文デコードエラー: {e}")
+        subject_raw = email_headers.get("Subject", "")
+        from_raw = email_headers.get("From", "")
+        to_raw = email_headers.get("To", "")
         
         return {
             "subject": self._decode_mime_words(subject_raw),
             "from": self._decode_mime_words(from_raw),
             "to": self._decode_mime_words(to_raw),
-            "date": email_message.get("Date", ""),
-            "body": body,
+            "date": email_headers.get("Date", ""),
+            "body": self._decode_body(body, charset),
             "received_at": datetime.now().isoformat()
         }
     
-    async def _save_email_file(self, email_id: str, email_message):
-        """メールファイルを保存"""
+    async def _save_email_file(self, mail, message_id: bytes, email_id: str, use_uid: bool) -> str:
+        """メール全体を分割取得しながらファイルに保存"""
         os.makedirs(settings.EMAIL_STORAGE_PATH, exist_ok=True)
         
         email_file_path = f"{settings.EMAIL_STORAGE_PATH}/{email_id}.eml"
         
         async with aiofiles.open(email_file_path, 'wb') as f:
-            await f.write(email_message.as_bytes())
+            await self._stream_section(mail, message_id, "", use_uid, f.write)
+        
+        return email_file_path
     
-    async def _process_attachments(self, email_message, email_id: str) -> List[str]:
-        """添付ファイルを処理してPDFファイルのパスを返す"""
+    def _process_attachments(self, email_file_path: str, email_id: str) -> Tuple[List[str], Dict[str, str], Dict[str, Any]]:
+        """保存済みメールファイルを走査し、PDF添付ファイルをデコードしながら書き出す
+        
+        書き出しと同時に各PDFのSHA-256を計算する（OCR結果キャッシュのキー）
+        
+        Returns:
+            (PDFファイルのパスのリスト, {PDFパス: SHA-256}, ヘッダー・本文の抽出結果)
+        """
         pdf_files = []
+        pdf_hashes = {}
         
         os.makedirs(settings.PDF_STORAGE_PATH, exist_ok=True)
         
-        for part in email_message.walk():
-            if part.get_content_disposition() == 'attachment':
-                filename = part.get_filename()
+        def open_attachment(part_headers):
+            if part_headers.get_content_disposition() == 'attachment':
+                filename = self._decode_mime_words(part_headers.get_filename() or "")
                 if filename and filename.lower().endswith('.pdf'):
                     # PDFファイルを保存
                     pdf_path = f"{settings.PDF_STORAGE_PATH}/{email_id}_{filename}"
-                    
-                    async with aiofiles.open(pdf_path, 'wb') as f:
-                        await f.write(part.get_payload(decode=True))
-                    
                     pdf_files.append(pdf_path)
+                    return _HashingFile(pdf_path, lambda digest: pdf_hashes.__setitem__(pdf_path, digest))
+            return None
         
-        return pdf_files
+        extracted = extract_message_file(email_file_path, open_attachment, settings.EMAIL_BODY_MAX_BYTES)
+        return pdf_files, pdf_hashes, extracted
     
     async def get_latest_emails(self) -> List[Dict[str, Any]]:
         """最新のメール一覧を取得"""
@@ -297,34 +652,28 @@ class EmailService:
         return emails[:10]  # 最新10件
     
     async def get_processed_ids_info(self) -> Dict[str, Any]:
-        """処理済みID情報を取得"""
+        """処理済みID情報を取得（IDは直近100件のみ返す）"""
         try:
-            if os.path.exists(self.processed_ids_file):
-                async with aiofiles.open(self.processed_ids_file, 'r') as f:
-                    content = await f.read()
-                    data = json.loads(content)
-                    return {
-                        "total_processed": len(data.get('processed_ids', [])),
-                        "last_updated": data.get('last_updated', ''),
-                        "processed_ids": data.get('processed_ids', [])
-                    }
-            return {
-                "total_processed": 0,
-                "last_updated": '',
-                "processed_ids": []
-            }
+            return await asyncio.to_thread(self.processed_store.get_info)
         except Exception as e:
             return {"error": f"処理済みID情報取得エラー: {str(e)}"}
     
     async def clear_processed_ids(self) -> Dict[str, Any]:
         """処理済みIDをクリア（管理用）"""
         try:
-            if os.path.exists(self.processed_ids_file):
-                os.remove(self.processed_ids_file)
+            await asyncio.to_thread(self.processed_store.clear)
+            # UID同期状態も合わせてリセットし、次回はフルリシンクさせる
+            if os.path.exists(self.sync_state_file):
+                os.remove(self.sync_state_file)
             return {"message": "処理済みIDをクリアしました"}
         except Exception as e:
             return {"error": f"処理済みIDクリアエラー: {str(e)}"}
     
+    async def aclose(self):
+        """処理済みIDストアとワークキューを閉じる"""
+        await asyncio.to_thread(self.processed_store.close)
+        await asyncio.to_thread(self.work_queue.close)
+    
     async def delete_email_file(self, email_id: str) -> bool:
         """メールファイルを削除"""
         try:
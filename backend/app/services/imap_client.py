@@ -0,0 +1,119 @@
+import asyncio
+import functools
+import imaplib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Optional, Tuple
+
+from app.core import settings
+from app.services.imap_pool import ImapConnectionPool, get_imap_pool
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_imap_executor() -> ThreadPoolExecutor:
+    """IMAP I/O専用のスレッドプールを取得"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max(settings.IMAP_POOL_SIZE, 1),
+                thread_name_prefix="imap-io"
+            )
+        return _executor
+
+
+def shutdown_imap_executor():
+    """IMAP I/O専用のスレッドプールを停止"""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+class AsyncImapConnection:
+    """プールから借りたIMAP接続のコマンドを専用スレッドで実行する非同期ラッパー"""
+
+    def __init__(self, mail: imaplib.IMAP4_SSL, executor: ThreadPoolExecutor):
+        self._mail = mail
+        self._executor = executor
+
+    async def _run(self, func, *args) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args))
+
+    async def select(self, mailbox: str = 'INBOX', readonly: bool = False) -> Tuple[str, list]:
+        return await self._run(self._mail.select, mailbox, readonly)
+
+    async def search(self, charset, *criteria) -> Tuple[str, list]:
+        return await self._run(self._mail.search, charset, *criteria)
+
+    async def fetch(self, message_set, message_parts) -> Tuple[str, list]:
+        return await self._run(self._mail.fetch, message_set, message_parts)
+
+    async def uid(self, command: str, *args) -> Tuple[str, list]:
+        return await self._run(self._mail.uid, command, *args)
+
+    async def status(self, mailbox: str, names: str) -> Tuple[str, list]:
+        return await self._run(self._mail.status, mailbox, names)
+
+    async def noop(self) -> Tuple[str, list]:
+        return await self._run(self._mail.noop)
+
+    def response(self, code: str) -> Tuple[str, list]:
+        # 受信済みの応答コードを参照するだけでI/Oは発生しない
+        return self._mail.response(code)
+
+
+class AsyncImapClient:
+    """コネクションプールと専用スレッドプールを使い、イベントループを止めずにIMAPを操作するクライアント"""
+
+    def __init__(self, pool: Optional[ImapConnectionPool] = None, executor: Optional[ThreadPoolExecutor] = None):
+        self.pool = pool or get_imap_pool()
+        self._executor = executor
+        # 接続の空きはasyncio側で待つ（ワーカースレッドやイベントループを塞がない）
+        self._slots = asyncio.Semaphore(self.pool.max_size)
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        return self._executor or get_imap_executor()
+
+    @staticmethod
+    async def _run_detached(executor: Optional[ThreadPoolExecutor], func, on_abandoned=None) -> Any:
+        """スレッドで func を実行する。呼び出し側がキャンセルされても func は最後まで実行し、
+        その結果は on_abandoned に渡す（取り出した接続を返却するため）"""
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(executor, func)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            def cleanup(done: asyncio.Future):
+                if on_abandoned is not None and not done.cancelled() and done.exception() is None:
+                    on_abandoned(done.result())
+            future.add_done_callback(cleanup)
+            raise
+
+    def _reserve_and_checkout(self) -> imaplib.IMAP4_SSL:
+        self.pool.reserve()
+        return self.pool.checkout()
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[AsyncImapConnection]:
+        """プールから接続を借りる（キャンセルされても、取り出した接続は必ずプールに返却する）"""
+        async with self._slots:
+            executor = self.executor
+            if self.pool.reserve(blocking=False):
+                mail = await self._run_detached(executor, self.pool.checkout, self.pool.checkin)
+            else:
+                # プールを同期APIの利用者と共有していて枠が空いていない場合。IMAP用のスレッドを塞がないよう既定のスレッドで待つ
+                mail = await self._run_detached(None, self._reserve_and_checkout, self.pool.checkin)
+            try:
+                yield AsyncImapConnection(mail, executor)
+            except BaseException:
+                await self._run_detached(executor, functools.partial(self.pool.checkin, mail, True))
+                raise
+            self.pool.checkin(mail)
@@ -0,0 +1,254 @@
+import base64
+import binascii
+import quopri
+import re
+from urllib.parse import unquote_to_bytes
+from typing import List, Dict, Any, Optional, Tuple
+
+
+_LITERAL_RE = re.compile(rb'\{(\d+)\}$')
+
+
+class ImapResponseParser:
+    """imaplibのFETCH応答（リテラル含む）をPythonオブジェクトに変換するパーサー"""
+
+    def __init__(self, data: list):
+        self._segments: List[Tuple[str, bytes]] = []
+        for item in data:
+            if isinstance(item, tuple):
+                self._segments.append(('text', item[0]))
+                self._segments.append(('literal', item[1]))
+            elif isinstance(item, bytes):
+                self._segments.append(('text', item))
+        self._tokens = self._tokenize()
+        self._pos = 0
+
+    def _tokenize(self) -> list:
+        tokens = []
+        literals = [seg for kind, seg in self._segments if kind == 'literal']
+        literal_index = 0
+        for kind, seg in self._segments:
+            if kind != 'text':
+                continue
+            i = 0
+            length = len(seg)
+            while i < length:
+                c = seg[i:i + 1]
+                if c in (b' ', b'\r', b'\n'):
+                    i += 1
+                elif c in (b'(', b')'):
+                    tokens.append(c)
+                    i += 1
+                elif c == b'"':
+                    # クォート文字列（バックスラッシュエスケープ対応）
+                    i += 1
+                    buf = bytearray()
+                    while i < length and seg[i:i + 1] != b'"':
+                        if seg[i:i + 1] == b'\\':
+                            i += 1
+                        buf += seg[i:i + 1]
+                        i += 1
+                    tokens.append(('str', bytes(buf)))
+                    i += 1
+                elif c == b'{' and _LITERAL_RE.match(seg[i:].rstrip()):
+                    # リテラル: 次のliteralセグメントが値になる
+                    tokens.append(('str', literals[literal_index]))
+                    literal_index += 1
+                    i = length
+                else:
+                    # アトム（BODY[HEADER.FIELDS (SUBJECT)] のような括弧内の空白も含める）
+                    start = i
+                    depth = 0
+                    while i < length:
+                        c = seg[i:i + 1]
+                        if c == b'[':
+                            depth += 1
+                        elif c == b']':
+                            depth -= 1
+                        elif depth == 0 and c in (b' ', b'(', b')', b'\r', b'\n'):
+                            break
+                        i += 1
+                    atom = seg[start:i]
+                    tokens.append(None if atom.upper() == b'NIL' else ('atom', atom))
+        return tokens
+
+    def _parse_value(self):
+        token = self._tokens[self._pos]
+        self._pos += 1
+        if token == b'(':
+            values = []
+            while self._tokens[self._pos] != b')':
+                values.append(self._parse_value())
+            self._pos += 1
+            return values
+        if token is None:
+            return None
+        return token[1]
+
+    def parse(self) -> Dict[int, Dict[str, Any]]:
+        """メッセージ番号ごとに {アイテム名: 値} の辞書を返す"""
+        messages: Dict[int, Dict[str, Any]] = {}
+        while self._pos < len(self._tokens):
+            number = self._parse_value()
+            items = self._parse_value()
+            if not isinstance(items, list):
+                continue
+            fields = messages.setdefault(int(number), {})
+            for i in range(0, len(items) - 1, 2):
+                key = items[i].decode().upper()
+                # BODY[1]<0> のような部分取得の応答は BODY[1] として扱う
+                key = re.sub(r'<\d+>$', '', key)
+                fields[key] = items[i + 1]
+        return messages
+
+
+def parse_fetch_response(data: list) -> Dict[int, Dict[str, Any]]:
+    """imaplibのFETCH応答データを解析"""
+    return ImapResponseParser(data).parse()
+
+
+def compress_uid_set(uids: List[int]) -> str:
+    """UIDのリストを 1:3,7,9:10 のようなシーケンスセット表記に変換"""
+    ranges = []
+    for uid in sorted(set(uids)):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ','.join(str(a) if a == b else f"{a}:{b}" for a, b in ranges)
+
+
+def _text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bytes):
+        return value.decode('utf-8', errors='ignore')
+    return str(value)
+
+
+def _decode_rfc2231(value: str) -> str:
+    """charset'language'%XX 形式のRFC 2231エンコード値をデコード"""
+    parts = value.split("'", 2)
+    if len(parts) != 3:
+        return value
+    charset = parts[0] or 'us-ascii'
+    try:
+        return unquote_to_bytes(parts[2]).decode(charset, errors='replace')
+    except LookupError:
+        return unquote_to_bytes(parts[2]).decode('utf-8', errors='replace')
+
+
+def _params_to_dict(params) -> Dict[str, str]:
+    """ボディパラメータリストを辞書化（RFC 2231 の分割・エンコードにも対応）"""
+    result: Dict[str, str] = {}
+    if not isinstance(params, list):
+        return result
+
+    continuations: Dict[str, Dict[int, Tuple[str, bool]]] = {}
+    for i in range(0, len(params) - 1, 2):
+        name = _text(params[i]).lower()
+        value = _text(params[i + 1])
+        match = re.match(r'^([^*]+)\*(\d+)(\*?)$', name)
+        if match:
+            continuations.setdefault(match.group(1), {})[int(match.group(2))] = (value, bool(match.group(3)))
+        elif name.endswith('*'):
+            result[name[:-1]] = _decode_rfc2231(value)
+        else:
+            result[name] = value
+
+    for name, parts in continuations.items():
+        encoded = any(is_encoded for _, is_encoded in parts.values())
+        joined = ''.join(parts[i][0] for i in sorted(parts))
+        result[name] = _decode_rfc2231(joined) if encoded else joined
+    return result
+
+
+def iter_body_parts(structure, section: str = "") -> List[Dict[str, Any]]:
+    """BODYSTRUCTUREを走査し、葉のパートをセクション番号付きで返す"""
+    if not isinstance(structure, list) or not structure:
+        return []
+
+    # マルチパート: 先頭要素が子パートのリスト
+    if isinstance(structure[0], list):
+        parts = []
+        index = 0
+        for child in structure:
+            if not isinstance(child, list):
+                break
+            index += 1
+            child_section = f"{section}.{index}" if section else str(index)
+            parts.extend(iter_body_parts(child, child_section))
+        return parts
+
+    section = section or "1"
+    maintype = _text(structure[0]).lower()
+    subtype = _text(structure[1]).lower()
+    params = _params_to_dict(structure[2]) if len(structure) > 2 else {}
+    encoding = _text(structure[5]).lower() if len(structure) > 5 else "7bit"
+    size = int(structure[6]) if len(structure) > 6 and structure[6] is not None else 0
+
+    # 拡張フィールドの位置は text / message/rfc822 で異なる
+    if maintype == "text":
+        ext_start = 8
+    elif maintype == "message" and subtype == "rfc822":
+        ext_start = 10
+    else:
+        ext_start = 7
+
+    disposition = None
+    disposition_params: Dict[str, str] = {}
+    if len(structure) > ext_start + 1 and isinstance(structure[ext_start + 1], list):
+        disp = structure[ext_start + 1]
+        disposition = _text(disp[0]).lower() if disp else None
+        disposition_params = _params_to_dict(disp[1]) if len(disp) > 1 else {}
+
+    # 添付メール（message/rfc822）の中身は N.x として再帰的に走査
+    if maintype == "message" and subtype == "rfc822" and len(structure) > 8:
+        nested = structure[8]
+        if isinstance(nested, list) and nested and isinstance(nested[0], list):
+            return iter_body_parts(nested, section)
+        return iter_body_parts(nested, f"{section}.1")
+
+    return [{
+        "section": section,
+        "content_type": f"{maintype}/{subtype}",
+        "charset": params.get("charset"),
+        "encoding": encoding,
+        "size": size,
+        "disposition": disposition,
+        "filename": disposition_params.get("filename") or params.get("name"),
+    }]
+
+
+def decode_part_payload(payload: Optional[bytes], encoding: str) -> bytes:
+    """Content-Transfer-Encodingに従ってパートの内容をデコード"""
+    if payload is None:
+        return b""
+    if encoding == "base64":
+        try:
+            return base64.b64decode(payload)
+        except (binascii.Error, ValueError):
+            # 不正なパディングや途中で切り詰めた内容は寛容にデコード（4文字に満たない端数の1文字は捨てる）
+            cleaned = re.sub(rb'[^A-Za-z0-9+/]', b'', payload)
+            if len(cleaned) % 4 == 1:
+                cleaned = cleaned[:-1]
+            cleaned += b'=' * (-len(cleaned) % 4)
+            return base64.b64decode(cleaned)
+    if encoding == "quoted-printable":
+        return quopri.decodestring(payload)
+    return payload
+
+
+def format_envelope_address(addresses) -> List[Tuple[str, str]]:
+    """ENVELOPEのアドレスリストを (表示名, メールアドレス) のリストに変換"""
+    result = []
+    if not isinstance(addresses, list):
+        return result
+    for address in addresses:
+        if not isinstance(address, list) or len(address) < 4:
+            continue
+        name = _text(address[0])
+        mailbox = _text(address[2])
+        host = _text(address[3])
+        result.append((name, f"{mailbox}@{host}" if host else mailbox))
+    return result
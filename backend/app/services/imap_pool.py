@@ -0,0 +1,147 @@
+import imaplib
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from app.core import settings
+
+
+class ImapConnectionPool:
+    """認証済みIMAP接続を保持して再利用するコネクションプール
+
+    - 貸し出し時、一定時間使われていない接続はNOOPで死活確認し、切断されていれば再接続する
+    - 同時に貸し出す接続数は max_size までに制限する
+    - 使用中に例外が発生した接続は状態が不明なため破棄する
+    """
+
+    def __init__(self, max_size: Optional[int] = None, health_check_seconds: Optional[int] = None):
+        self.max_size = max(max_size or settings.IMAP_POOL_SIZE, 1)
+        self.health_check_seconds = health_check_seconds if health_check_seconds is not None else settings.IMAP_POOL_HEALTH_CHECK_SECONDS
+        self._idle: List[Tuple[imaplib.IMAP4_SSL, float]] = []
+        self._lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(self.max_size)
+        self._in_use = 0
+        self._stats = {
+            "connects": 0,
+            "reuses": 0,
+            "reconnects": 0,
+            "discarded": 0
+        }
+
+    def _connect(self) -> imaplib.IMAP4_SSL:
+        """新しいIMAP接続を作成してログイン"""
+        mail = imaplib.IMAP4_SSL(settings.GMAIL_IMAP_SERVER, settings.GMAIL_IMAP_PORT)
+        mail.login(settings.GMAIL_EMAIL, settings.GMAIL_PASSWORD)
+        with self._lock:
+            self._stats["connects"] += 1
+        return mail
+
+    def _is_alive(self, mail: imaplib.IMAP4_SSL, last_used: float) -> bool:
+        """しばらく使われていない接続をNOOPで確認"""
+        if time.monotonic() - last_used < self.health_check_seconds:
+            return True
+        try:
+            status, _ = mail.noop()
+            return status == 'OK'
+        except Exception:
+            return False
+
+    def _close(self, mail: imaplib.IMAP4_SSL):
+        try:
+            mail.logout()
+        except Exception:
+            try:
+                mail.shutdown()
+            except Exception:
+                pass
+
+    def _acquire(self) -> imaplib.IMAP4_SSL:
+        while True:
+            with self._lock:
+                entry = self._idle.pop() if self._idle else None
+            if entry is None:
+                return self._connect()
+
+            mail, last_used = entry
+            if self._is_alive(mail, last_used):
+                with self._lock:
+                    self._stats["reuses"] += 1
+                return mail
+
+            # 切断済みの接続は破棄して次の接続（なければ新規接続）を試す
+            print("IMAP接続が切断されていたため再接続します")
+            self._close(mail)
+            with self._lock:
+                self._stats["reconnects"] += 1
+
+    def reserve(self, blocking: bool = True) -> bool:
+        """接続の貸し出し枠を確保（max_size を超える場合は待機、blocking=False なら即座にFalse）"""
+        return self._semaphore.acquire(blocking=blocking)
+
+    def checkout(self) -> imaplib.IMAP4_SSL:
+        """確保済みの枠で接続を取り出す（失敗した場合は枠を解放して例外を送出）"""
+        try:
+            mail = self._acquire()
+        except BaseException:
+            self._semaphore.release()
+            raise
+        with self._lock:
+            self._in_use += 1
+        return mail
+
+    def checkin(self, mail: imaplib.IMAP4_SSL, discard: bool = False):
+        """接続を返却して枠を解放（discard=True の場合は接続を破棄）"""
+        try:
+            with self._lock:
+                self._in_use -= 1
+                if not discard:
+                    self._idle.append((mail, time.monotonic()))
+                else:
+                    self._stats["discarded"] += 1
+            if discard:
+                self._close(mail)
+        finally:
+            self._semaphore.release()
+
+    @contextmanager
+    def connection(self) -> Iterator[imaplib.IMAP4_SSL]:
+        """プールから接続を借りる（withブロックを抜けると返却される）"""
+        self.reserve()
+        mail = self.checkout()
+        try:
+            yield mail
+        except BaseException:
+            self.checkin(mail, discard=True)
+            raise
+        self.checkin(mail)
+
+    def close_all(self):
+        """待機中の接続をすべてログアウト"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for mail, _ in idle:
+            self._close(mail)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """プールの利用状況を取得"""
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                **self._stats
+            }
+
+
+_pool: Optional[ImapConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_imap_pool() -> ImapConnectionPool:
+    """プロセス共有のIMAPコネクションプールを取得"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ImapConnectionPool()
+        return _pool
@@ -0,0 +1,201 @@
+import base64
+import binascii
+import quopri
+import re
+from email.message import Message
+from email.parser import BytesHeaderParser
+from typing import BinaryIO, Callable, Dict, Any, List, Optional
+
+# 1行として一度に読み込む最大バイト数（改行のない巨大なパートでもメモリを固定量に抑える）
+_READ_LIMIT = 64 * 1024
+
+
+class IncrementalDecoder:
+    """Content-Transfer-Encodingをチャンク単位でデコードする"""
+
+    def __init__(self, encoding: Optional[str]):
+        self.encoding = (encoding or "7bit").lower()
+        self._buffer = b""
+
+    def decode(self, data: bytes) -> bytes:
+        if self.encoding == "base64":
+            self._buffer += re.sub(rb'[^A-Za-z0-9+/=]', b'', data)
+            size = len(self._buffer) // 4 * 4
+            chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+            return self._b64decode(chunk)
+        if self.encoding == "quoted-printable":
+            # ソフト改行やエスケープが行をまたがないよう、完全な行だけをデコードする
+            self._buffer += data
+            end = self._buffer.rfind(b"\n") + 1
+            chunk, self._buffer = self._buffer[:end], self._buffer[end:]
+            return quopri.decodestring(chunk)
+        return data
+
+    def flush(self) -> bytes:
+        chunk, self._buffer = self._buffer, b""
+        if self.encoding == "base64":
+            return self._b64decode(chunk + b'=' * (-len(chunk) % 4)) if chunk.strip(b'=') else b""
+        if self.encoding == "quoted-printable":
+            return quopri.decodestring(chunk)
+        return chunk
+
+    @staticmethod
+    def _b64decode(chunk: bytes) -> bytes:
+        try:
+            return base64.b64decode(chunk)
+        except (binascii.Error, ValueError):
+            # 途中に紛れたパディングなどは無視して寛容にデコード
+            cleaned = chunk.replace(b'=', b'')
+            cleaned = cleaned[:len(cleaned) // 4 * 4]
+            return base64.b64decode(cleaned) if cleaned else b""
+
+
+def _read_headers(f: BinaryIO) -> Message:
+    """空行までのヘッダーブロックを読み込んで解析"""
+    lines = []
+    while True:
+        line = f.readline(_READ_LIMIT)
+        if not line or line in (b"\r\n", b"\n"):
+            break
+        lines.append(line)
+    return BytesHeaderParser().parsebytes(b"".join(lines))
+
+
+class StreamingMessageExtractor:
+    """保存済みのメールファイルを行単位で走査し、本文と添付ファイルを逐次取り出す
+
+    - 添付ファイルは open_attachment が返したファイルにデコードしながら書き込む
+    - 本文は最初の text/plain パートのみ max_body_size まで保持する
+    """
+
+    def __init__(self, open_attachment: Callable[[Message], Optional[BinaryIO]], max_body_size: int = 1024 * 1024):
+        self.open_attachment = open_attachment
+        self.max_body_size = max_body_size
+        self.body: Optional[bytes] = None
+        self.body_charset: Optional[str] = None
+
+    def extract(self, f: BinaryIO) -> Message:
+        """メッセージ全体を処理し、トップレベルのヘッダーを返す"""
+        headers = _read_headers(f)
+        self._walk(f, headers, [])
+        return headers
+
+    @staticmethod
+    def _match_boundary(line: bytes, boundaries: List[bytes]) -> Optional[bytes]:
+        if not line.startswith(b"--"):
+            return None
+        stripped = line.rstrip()
+        for boundary in reversed(boundaries):
+            if stripped == b"--" + boundary or stripped == b"--" + boundary + b"--":
+                return stripped
+        return None
+
+    def _walk(self, f: BinaryIO, headers: Message, boundaries: List[bytes]) -> bytes:
+        """パートを処理し、終端に達した区切り行（EOFなら b""）を返す"""
+        content_type = headers.get_content_type()
+
+        if content_type == "message/rfc822":
+            # 添付メールの中身も再帰的に走査する
+            return self._walk(f, _read_headers(f), boundaries)
+
+        if headers.get_content_maintype() == "multipart" and headers.get_boundary():
+            boundary = headers.get_boundary().encode('utf-8', errors='ignore')
+            child_boundaries = boundaries + [boundary]
+            line = self._skip_until_boundary(f, child_boundaries)
+            while line:
+                if line == b"--" + boundary:
+                    line = self._walk(f, _read_headers(f), child_boundaries)
+                    continue
+                if line == b"--" + boundary + b"--":
+                    # エピローグを読み飛ばして親の区切りまで進む
+                    return self._skip_until_boundary(f, boundaries)
+                # 親の区切りに達した（閉じ区切りの欠落）
+                return line
+            return b""
+
+        return self._read_leaf(f, headers, boundaries)
+
+    def _skip_until_boundary(self, f: BinaryIO, boundaries: List[bytes]) -> bytes:
+        at_line_start = True
+        while True:
+            line = f.readline(_READ_LIMIT)
+            if not line:
+                return b""
+            if at_line_start:
+                matched = self._match_boundary(line, boundaries)
+                if matched:
+                    return matched
+            at_line_start = line.endswith(b"\n")
+
+    def _read_leaf(self, f: BinaryIO, headers: Message, boundaries: List[bytes]) -> bytes:
+        decoder = IncrementalDecoder(headers.get("Content-Transfer-Encoding", "7bit").strip())
+        sink = self.open_attachment(headers)
+        collect_body = (
+            sink is None
+            and self.body is None
+            and headers.get_content_type() == "text/plain"
+            and headers.get_content_disposition() != "attachment"
+        )
+        body = bytearray()
+
+        def write(data: bytes):
+            decoded = decoder.decode(data)
+            if sink is not None:
+                sink.write(decoded)
+            elif collect_body and len(body) < self.max_body_size:
+                body.extend(decoded[:self.max_body_size - len(body)])
+
+        # 区切り行直前の改行は区切りの一部なので、次の行が来るまで書き込みを保留する
+        pending_eol = b""
+        at_line_start = True
+        terminator = b""
+        try:
+            while True:
+                line = f.readline(_READ_LIMIT)
+                if not line:
+                    break
+                if at_line_start and boundaries:
+                    matched = self._match_boundary(line, boundaries)
+                    if matched:
+                        terminator = matched
+                        break
+                at_line_start = line.endswith(b"\n")
+                content = line
+                eol = b""
+                if line.endswith(b"\r\n"):
+                    content, eol = line[:-2], b"\r\n"
+                elif line.endswith(b"\n"):
+                    content, eol = line[:-1], b"\n"
+                write(pending_eol + content)
+                pending_eol = eol
+            if not boundaries and pending_eol:
+                write(pending_eol)
+
+            tail = decoder.flush()
+            if sink is not None:
+                sink.write(tail)
+            elif collect_body:
+                body.extend(tail[:max(self.max_body_size - len(body), 0)])
+        finally:
+            if sink is not None:
+                sink.close()
+
+        if collect_body:
+            self.body = bytes(body)
+            self.body_charset = headers.get_content_charset()
+        return terminator
+
+
+def extract_message_file(path: str, open_attachment: Callable[[Message], Optional[BinaryIO]], max_body_size: int = 1024 * 1024) -> Dict[str, Any]:
+    """メールファイルをストリーミングで解析し、ヘッダーと本文を返す
+
+    添付ファイルの内容は open_attachment に渡したファイルへ直接書き込まれる
+    """
+    extractor = StreamingMessageExtractor(open_attachment, max_body_size)
+    with open(path, 'rb') as f:
+        headers = extractor.extract(f)
+    return {
+        "headers": headers,
+        "body": extractor.body or b"",
+        "body_charset": extractor.body_charset
+    }
@@ -1,29 +1,106 @@
-from notion_client import Client
+import asyncio
+import httpx
+from notion_client import APIResponseError, AsyncClient
+from notion_client.errors import HTTPResponseError, RequestTimeoutError
 from typing import Dict, Any, Optional
 from app.core import settings
+from app.core.rate_limiter import TokenBucket
+from app.core.resilience import ResilientEndpoint
+from app.services.client_index import ClientIndex
+from app.services.client_matcher import ClientMatcher, normalize_for_matching
+from app.services.client_snapshot import ClientSnapshotStore
 from datetime import datetime, timedelta
 from email.utils import parsedate_to_datetime
 
 
+def _is_transient_notion_error(error: BaseException) -> bool:
+    """タイムアウト・接続失敗・5xx（429はレートリミッター側で待機して再試行する）"""
+    if isinstance(error, HTTPResponseError):
+        return error.status >= 500
+    return isinstance(error, (RequestTimeoutError, httpx.TransportError))
+
+
+def _is_unsent_notion_error(error: BaseException) -> bool:
+    return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout))
+
+
 class NotionService:
     """Notion API連携サービス"""
     
     def __init__(self):
         if settings.NOTION_TOKEN:
-            self.notion = Client(auth=settings.NOTION_TOKEN)
+            # 非同期クライアントを使い、複数ドキュメントのNotion呼び出しを並行させる
+            self.notion = AsyncClient(auth=settings.NOTION_TOKEN)
         else:
             self.notion = None
         
-        # クライアントデータのキャッシュ
-        self._clients_cache: Optional[list] = None
-        self._cache_timestamp: Optional[datetime] = None
-        self._cache_duration = timedelta(minutes=5)  # キャッシュの有効期限（5分）
+        # クライアントDBのスナップショット（起動時にディスクから読み込み、バックグラウンドで差分同期）
+        self.client_snapshot = ClientSnapshotStore()
+        snapshot = self.client_snapshot.load()
+        self._clients_cache: Optional[list] = snapshot["clients"] if snapshot["last_synced_at"] else None
+        self.client_index = ClientIndex(self._clients_cache or [])
+        self.client_matcher = ClientMatcher(self._clients_cache or [])
+        self._last_edited_time: Optional[str] = snapshot["last_edited_time"]
+        self._last_full_sync: Optional[str] = snapshot["last_full_sync"]
+        self._last_synced_at: Optional[str] = snapshot["last_synced_at"]
+        self._sync_lock = asyncio.Lock()
+        self._memo_stats = {"hits": 0, "misses": 0}
+        
+        # Notion APIの呼び出しはすべてこのレートリミッターを通す（上限を超える分は待機させる）
+        self.rate_limiter = TokenBucket(settings.NOTION_RATE_LIMIT_PER_SECOND, settings.NOTION_RATE_LIMIT_BURST)
+        # 一時的な障害の再試行と、停止中の即時失敗
+        self.api_endpoint = ResilientEndpoint("notion.api", _is_transient_notion_error, _is_unsent_notion_error)
+    
+    async def aclose(self):
+        """Notionクライアントの接続とスナップショットを閉じる"""
+        if self.notion:
+            await self.notion.aclose()
+        await asyncio.to_thread(self.client_snapshot.close)
+    
+    async def _request(self, method, idempotent: bool = True, **kwargs) -> Dict[str, Any]:
+        """レートリミッターとサーキットブレーカーを通してNotion APIを呼び出す
+        
+        一時的な障害はジッター付き指数バックオフで再試行する（ページ作成など冪等でない呼び出しは、
+        リクエストが送られていないことが確実な場合のみ）
+        """
+        return await self.api_endpoint.call(self._request_once, method, idempotent=idempotent, **kwargs)
+    
+    async def _request_once(self, method, **kwargs) -> Dict[str, Any]:
+        """429（rate_limited）が返った場合は Retry-After の間すべての呼び出しを止めてから再試行する"""
+        for attempt in range(settings.NOTION_RATE_LIMIT_MAX_RETRIES + 1):
+            await self.rate_limiter.acquire()
+            try:
+                return await method(**kwargs)
+            except APIResponseError as e:
+                if e.status != 429 or attempt >= settings.NOTION_RATE_LIMIT_MAX_RETRIES:
+                    raise
+                retry_after = self._retry_after_seconds(e)
+                print(f"Notion APIのレート制限に達したため{retry_after:.1f}秒待機して再試行します")
+                self.rate_limiter.pause(retry_after)
+    
+    @staticmethod
+    def _retry_after_seconds(error: APIResponseError) -> float:
+        headers = getattr(error, "headers", None) or {}
+        try:
+            return max(float(headers.get("retry-after") or headers.get("Retry-After") or 1), 0)
+        except (TypeError, ValueError):
+            return 1.0
+    
+    def get_rate_limit_stats(self) -> Dict[str, Any]:
+        """レートリミッターの待機時間などを取得"""
+        return self.rate_limiter.get_stats()
+    
+    def get_circuit_breaker_stats(self) -> Dict[str, Any]:
+        """サーキットブレーカーの状態を取得"""
+        return {"api": self.api_endpoint.get_stats()}
     
     async def get_all_clients(self, force_refresh: bool = False) -> list:
         """クライアントデータベースから全クライアント情報を取得
         
+        通常はローカルのスナップショットを返し、Notionには問い合わせない（同期は sync_clients で行う）
+        
         Args:
-            force_refresh: Trueの場合、キャッシュを無視して強制的に再取得
+            force_refresh: Trueの場合、フル同期してから返す
         
         Returns:
             クライアント情報のリスト
@@ -32,12 +109,65 @@ class NotionService:
             if not self.notion or not settings.NOTION_CLIENT_DATABASE_ID:
                 return []
             
-            # キャッシュが有効な場合はキャッシュから返す
-            if not force_refresh and self._is_cache_valid():
-                print("クライアントデータをキャッシュから取得")
-                return self._clients_cache
+            # 一度も同期していない場合のみ、この場で同期する
+            if force_refresh or self._clients_cache is None:
+                await self.sync_clients(full=True)
+            
+            return self._clients_cache or []
+            
+        except Exception as e:
+            print(f"クライアント一覧取得エラー: {str(e)}")
+            return []
+    
+    def _parse_client_page(self, page: Dict[str, Any]) -> Dict[str, Any]:
+        """クライアントDBのページからID・名前・略称を抽出"""
+        client_info = {
+            "id": page["id"],
+            "name": "",
+            "abbreviation": "",
+            "last_edited_time": page.get("last_edited_time", "")
+        }
+        
+        # クライアント名（タイトル）を取得
+        if "properties" in page:
+            for prop_name, prop_value in page["properties"].items():
+                if prop_value["type"] == "title" and prop_value["title"]:
+                    client_info["name"] = prop_value["title"][0]["text"]["content"]
+                    break
+            
+            # 略称を取得
+            if "略称" in page["properties"]:
+                abbrev_prop = page["properties"]["略称"]
+                if abbrev_prop["type"] == "rich_text" and abbrev_prop["rich_text"]:
+                    client_info["abbreviation"] = abbrev_prop["rich_text"][0]["text"]["content"]
+        
+        return client_info
+    
+    def _needs_full_sync(self) -> bool:
+        if self._clients_cache is None or not self._last_full_sync:
+            return True
+        last_full_sync = datetime.fromisoformat(self._last_full_sync)
+        return datetime.now() - last_full_sync >= timedelta(hours=settings.NOTION_CLIENT_FULL_SYNC_HOURS)
+    
+    async def sync_clients(self, full: Optional[bool] = None) -> Dict[str, Any]:
+        """クライアントDBをスナップショットに同期
+        
+        差分同期では前回の同期位置以降に編集されたページだけを取得する。
+        削除されたページは差分では検知できないため、NOTION_CLIENT_FULL_SYNC_HOURS ごとにフル同期する。
+        
+        Args:
+            full: Trueでフル同期、Falseで差分同期、Noneの場合は前回のフル同期からの経過時間で判断
+        """
+        if not self.notion or not settings.NOTION_CLIENT_DATABASE_ID:
+            return {"status": "skipped"}
+        
+        async with self._sync_lock:
+            if full is None:
+                full = self._needs_full_sync()
+            since = None if full or not self._last_edited_time else self._last_edited_time
             
-            all_clients = []
+            changed_clients = []
+            removed_ids = []
             has_more = True
             start_cursor = None
             
@@ -47,84 +177,120 @@ class NotionService:
                     "database_id": settings.NOTION_CLIENT_DATABASE_ID,
                     "page_size": 100
                 }
+                if since:
+                    # last_edited_time は分単位のため、同じ時刻のページも含めて取得する（反映は冪等）
+                    params["filter"] = {
+                        "timestamp": "last_edited_time",
+                        "last_edited_time": {"on_or_after": since}
+                    }
                 if start_cursor:
                     params["start_cursor"] = start_cursor
                 
-                response = self.notion.databases.query(**params)
+                response = await self._request(self.notion.databases.query, **params)
                 
                 # 各クライアントの情報を抽出
                 for page in response["results"]:
-                    client_info = {
-                        "id": page["id"],
-                        "name": "",
-                        "abbreviation": ""
-                    }
-                    
-                    # クライアント名（タイトル）を取得
-                    if "properties" in page:
-                        for prop_name, prop_value in page["properties"].items():
-                            if prop_value["type"] == "title" and prop_value["title"]:
-                                client_info["name"] = prop_value["title"][0]["text"]["content"]
-                                break
-                        
-                        # 略称を取得
-                        if "略称" in page["properties"]:
-                            abbrev_prop = page["properties"]["略称"]
-                            if abbrev_prop["type"] == "rich_text" and abbrev_prop["rich_text"]:
-                                client_info["abbreviation"] = abbrev_prop["rich_text"][0]["text"]["content"]
-                    
-                    if client_info["name"]:  # 名前がある場合のみ追加
-                        all_clients.append(client_info)
+                    client_info = self._parse_client_page(page)
+                    if client_info["name"] and not page.get("archived") and not page.get("in_trash"):  # 名前がある場合のみ追加
+                        changed_clients.append(client_info)
+                    else:
+                        removed_ids.append(page["id"])
                 
                 # 次のページがあるか確認
                 has_more = response.get("has_more", False)
                 start_cursor = response.get("next_cursor", None)
             
-            # キャッシュを更新
-            self._clients_cache = all_clients
-            self._cache_timestamp = datetime.now()
-            print(f"クライアントデータをキャッシュに保存: {len(all_clients)}件")
-            
-            return all_clients
-            
-        except Exception as e:
-            print(f"クライアント一覧取得エラー: {str(e)}")
-            return []
+            snapshot_changed = await asyncio.to_thread(self.client_snapshot.apply, changed_clients, removed_ids, full)
+            if snapshot_changed:
+                print("クライアントデータが変更されたため、vendorの照合メモを破棄しました")
+            snapshot = await asyncio.to_thread(self.client_snapshot.load)
+            self._clients_cache = snapshot["clients"]
+            self.client_index = ClientIndex(self._clients_cache)
+            self.client_matcher = ClientMatcher(self._clients_cache)
+            self._last_edited_time = snapshot["last_edited_time"]
+            self._last_full_sync = snapshot["last_full_sync"]
+            self._last_synced_at = snapshot["last_synced_at"]
+            
+            print(f"クライアントデータを{'フル' if full else '差分'}同期しました: 更新{len(changed_clients)}件 / 削除{len(removed_ids)}件 / 合計{len(self._clients_cache)}件")
+            return {
+                "status": "success",
+                "full": full,
+                "changed": len(changed_clients),
+                "removed": len(removed_ids),
+                "total": len(self._clients_cache)
+            }
     
-    def _is_cache_valid(self) -> bool:
-        """キャッシュが有効かどうかを確認"""
-        if self._clients_cache is None or self._cache_timestamp is None:
-            return False
-        
-        # キャッシュの有効期限をチェック
-        return datetime.now() - self._cache_timestamp < self._cache_duration
+    async def lookup_vendor_match(self, vendor: str) -> Optional[Dict[str, Any]]:
+        """以前に解決したvendorの照合結果を、曖昧検索の結果と同じ形式で取得（なければNone）"""
+        vendor_key = normalize_for_matching(vendor)
+        memo = await asyncio.to_thread(self.client_snapshot.get_vendor_match, vendor_key) if vendor_key else None
+        # スナップショットから消えたクライアントを指すメモは使わない
+        if memo is not None and memo["client_id"] != "null" and self.client_index.get(memo["client_id"]) is None:
+            memo = None
+        if memo is None:
+            self._memo_stats["misses"] += 1
+            return None
+        self._memo_stats["hits"] += 1
+        return {
+            "result": {"id": memo["client_id"], "name": memo["client_name"]},
+            "source": "memo",
+            "score": memo["confidence"]
+        }
     
-    def clear_cache(self):
-        """キャッシュをクリア"""
-        self._clients_cache = None
-        self._cache_timestamp = None
-        print("クライアントデータのキャッシュをクリア")
+    async def remember_vendor_match(self, vendor: str, fuzzy_search_result: Dict[str, Any]):
+        """曖昧検索で解決したvendorの照合結果をメモ（エラーの結果は保存しない）"""
+        vendor_key = normalize_for_matching(vendor)
+        result = fuzzy_search_result.get("result") if isinstance(fuzzy_search_result, dict) else None
+        if not vendor_key or not isinstance(result, dict) or not result.get("id"):
+            return
+        confidence = next(
+            (value for value in (result.get("confidence"), result.get("score"), fuzzy_search_result.get("score"))
+             if isinstance(value, (int, float))),
+            None
+        )
+        await asyncio.to_thread(
+            self.client_snapshot.put_vendor_match,
+            vendor_key, str(result["id"]), result.get("name", ""), confidence
+        )
+    
+    def get_snapshot_info(self) -> Dict[str, Any]:
+        """スナップショットの件数と同期状況、vendorの照合メモの利用状況を取得"""
+        return {
+            "count": len(self._clients_cache or []),
+            "last_synced_at": self._last_synced_at,
+            "last_full_sync": self._last_full_sync,
+            "last_edited_time": self._last_edited_time,
+            "vendor_memo": {
+                "entries": self.client_snapshot.count_vendor_matches(),
+                **self._memo_stats
+            }
+        }
     
     async def find_client_by_name(self, client_name: str) -> tuple:
         """クライアント名でクライアントデータベースを検索し、ページIDと略称を返す
         
-        キャッシュが利用可能な場合は、キャッシュから検索を行う
+        スナップショットが利用可能な場合は、スナップショットから検索を行う
         """
         try:
             if not self.notion or not settings.NOTION_CLIENT_DATABASE_ID:
                 return None, None
             
-            # キャッシュが有効な場合は、キャッシュから検索
-            if self._is_cache_valid():
+            # スナップショットがある場合は、索引から名前・略称・部分一致の順に検索
+            if self._clients_cache is not None:
                 print(f"キャッシュからクライアントを検索: {client_name}")
-                for client in self._clients_cache:
-                    if client_name in client["name"]:
-                        return client["id"], client["abbreviation"]
+                client = (
+                    self.client_index.find_by_name(client_name)
+                    or self.client_index.find_by_abbreviation(client_name)
+                    or self.client_matcher.find_containing(client_name)
+                )
+                if client is not None:
+                    return client["id"], client["abbreviation"]
                 return None, None
             
             # クライアントデータベースを検索
             # タイトルプロパティの場合、プロパティ名ではなく"title"を直接使用
-            response = self.notion.databases.query(
+            response = await self._request(
+                self.notion.databases.query,
                 database_id=settings.NOTION_CLIENT_DATABASE_ID,
                 filter={
                     "property": "title",  # タイトルプロパティ
@@ -324,8 +490,11 @@ class NotionService:
                     client_name = result.get("name", "")
                     print(f"曖昧検索で一致したクライアントを使用: {client_name} (ID: {client_id})")
                     
-                    # 曖昧検索で見つかったクライアントの略称を取得
-                    if client_name:
+                    # 曖昧検索で見つかったクライアントの略称を索引から取得（Notionへの問い合わせは不要）
+                    client = self.client_index.get(client_id) or self.client_index.find_by_name(client_name)
+                    if client is not None:
+                        client_abbreviation = client["abbreviation"]
+                    elif client_name:
                         _, client_abbreviation = await self.find_client_by_name(client_name)
                 else:
                     print(f"曖昧検索結果: {result.get('name', '該当なし')}")
@@ -358,7 +527,10 @@ class NotionService:
                     ]
                 }
             
-            response = self.notion.pages.create(
+            # ページ作成は冪等でないため、送信済みの可能性がある失敗は再試行しない（重複登録を防ぐ）
+            response = await self._request(
+                self.notion.pages.create,
+                idempotent=False,
                 parent={"database_id": settings.NOTION_DATABASE_ID},
                 properties=properties
             )
@@ -0,0 +1,121 @@
+import json
+import threading
+import time
+from typing import Dict, Any, Optional
+
+from app.core import settings
+from app.core.database import connect_sqlite
+
+
+class OcrCache:
+    """PDFの内容ハッシュ（SHA-256）をキーにDifyのOCR結果を保存する永続キャッシュ
+
+    - OCR_CACHE_MAX_AGE_DAYS を過ぎたエントリは無効
+    - 合計サイズが OCR_CACHE_MAX_SIZE_MB を超えた場合は最終参照が古いものから削除
+    - ヒット・ミス数はDBに保存するため、ジョブとAPIで同じ統計を参照できる
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or f"{settings.STORAGE_PATH}/ocr_cache.db"
+        self.max_age_seconds = settings.OCR_CACHE_MAX_AGE_DAYS * 24 * 60 * 60
+        self.max_size_bytes = settings.OCR_CACHE_MAX_SIZE_MB * 1024 * 1024
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(self.db_path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ocr_cache ("
+            " content_hash TEXT PRIMARY KEY,"
+            " result TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_accessed REAL NOT NULL"
+            ")"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_ocr_cache_last_accessed ON ocr_cache (last_accessed)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ocr_cache_stats ("
+            " name TEXT PRIMARY KEY,"
+            " value INTEGER NOT NULL"
+            ")"
+        )
+
+    def _count(self, name: str):
+        self._conn.execute(
+            "INSERT INTO ocr_cache_stats (name, value) VALUES (?, 1)"
+            " ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,)
+        )
+
+    def get(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        """キャッシュ済みのOCR結果を取得（なければNone）"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result, created_at FROM ocr_cache WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+            if row is not None and now - row[1] > self.max_age_seconds:
+                self._conn.execute("DELETE FROM ocr_cache WHERE content_hash = ?", (content_hash,))
+                row = None
+            if row is None:
+                self._count("misses")
+                return None
+            self._conn.execute(
+                "UPDATE ocr_cache SET last_accessed = ? WHERE content_hash = ?", (now, content_hash)
+            )
+            self._count("hits")
+        return json.loads(row[0])
+
+    def put(self, content_hash: str, result: Dict[str, Any]):
+        """OCR結果を保存し、期限切れ・容量超過のエントリを削除"""
+        payload = json.dumps(result, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO ocr_cache (content_hash, result, size, created_at, last_accessed)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (content_hash, payload, len(payload.encode('utf-8')), now, now)
+                )
+                self._evict(now)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _evict(self, now: float):
+        self._conn.execute("DELETE FROM ocr_cache WHERE created_at < ?", (now - self.max_age_seconds,))
+        total_size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_cache").fetchone()[0]
+        if total_size <= self.max_size_bytes:
+            return
+        for content_hash, size in self._conn.execute(
+            "SELECT content_hash, size FROM ocr_cache ORDER BY last_accessed ASC"
+        ).fetchall():
+            if total_size <= self.max_size_bytes:
+                break
+            self._conn.execute("DELETE FROM ocr_cache WHERE content_hash = ?", (content_hash,))
+            total_size -= size
+
+    def get_stats(self) -> Dict[str, Any]:
+        """エントリ数・サイズ・ヒット率を取得"""
+        with self._lock:
+            entries, total_size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM ocr_cache"
+            ).fetchone()
+            counters = dict(self._conn.execute("SELECT name, value FROM ocr_cache_stats").fetchall())
+        hits = counters.get("hits", 0)
+        misses = counters.get("misses", 0)
+        lookups = hits + misses
+        return {
+            "entries": entries,
+            "total_size": total_size,
+            "total_size_mb": round(total_size / (1024 * 1024), 2),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
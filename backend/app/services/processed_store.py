@@ -0,0 +1,123 @@
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Any, Iterable, List, Optional, Set
+
+from app.core import settings
+from app.core.database import connect_sqlite
+
+
+class ProcessedMessageStore:
+    """処理済みメールIDを保持するSQLiteストア
+
+    メンバーシップ確認は主キー検索、追加は1行のINSERTのみで済む。
+    旧形式の processed_email_ids.json が残っている場合は初回に取り込み、.migrated にリネームする。
+    """
+
+    def __init__(self, db_path: Optional[str] = None, legacy_json_path: Optional[str] = None):
+        self.db_path = db_path or f"{settings.STORAGE_PATH}/processed_messages.db"
+        self.legacy_json_path = legacy_json_path or f"{settings.STORAGE_PATH}/processed_email_ids.json"
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(self.db_path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS processed_messages ("
+            " email_id TEXT PRIMARY KEY,"
+            " processed_at TEXT NOT NULL"
+            ")"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_processed_messages_processed_at"
+            " ON processed_messages (processed_at)"
+        )
+        self._migrate_legacy_json()
+
+    def _migrate_legacy_json(self):
+        """旧形式のJSONファイルから処理済みIDを取り込む"""
+        if not os.path.exists(self.legacy_json_path):
+            return
+        try:
+            with open(self.legacy_json_path, 'r') as f:
+                data = json.load(f)
+            processed_ids = data.get('processed_ids', [])
+            migrated_at = data.get('last_updated') or datetime.now().isoformat()
+            with self._lock:
+                self._conn.execute("BEGIN")
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO processed_messages (email_id, processed_at) VALUES (?, ?)",
+                    [(str(email_id), migrated_at) for email_id in processed_ids]
+                )
+                self._conn.execute("COMMIT")
+            os.replace(self.legacy_json_path, f"{self.legacy_json_path}.migrated")
+            print(f"処理済みIDをSQLiteに移行しました: {len(processed_ids)}件")
+        except Exception as e:
+            print(f"処理済みIDの移行エラー: {e}")
+
+    def contains(self, email_id: str) -> bool:
+        """処理済みかどうかを確認"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM processed_messages WHERE email_id = ?", (email_id,)
+            ).fetchone()
+        return row is not None
+
+    def add(self, email_id: str):
+        """処理済みIDを追加"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO processed_messages (email_id, processed_at) VALUES (?, ?)",
+                (email_id, datetime.now().isoformat())
+            )
+
+    def filter_processed(self, email_ids: Iterable[str]) -> Set[str]:
+        """与えたIDのうち処理済みのものを返す"""
+        email_ids = list(email_ids)
+        found: Set[str] = set()
+        with self._lock:
+            for i in range(0, len(email_ids), 500):
+                chunk = email_ids[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                found.update(
+                    row[0] for row in self._conn.execute(
+                        f"SELECT email_id FROM processed_messages WHERE email_id IN ({placeholders})", chunk
+                    )
+                )
+        return found
+
+    def add_many(self, email_ids: Iterable[str]):
+        """処理済みIDをまとめて追加"""
+        now = datetime.now().isoformat()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO processed_messages (email_id, processed_at) VALUES (?, ?)",
+                [(email_id, now) for email_id in email_ids]
+            )
+            self._conn.execute("COMMIT")
+
+    def get_info(self, recent_limit: int = 100) -> Dict[str, Any]:
+        """件数・最終更新日時・直近の処理済みIDを取得"""
+        with self._lock:
+            total, last_updated = self._conn.execute(
+                "SELECT COUNT(*), MAX(processed_at) FROM processed_messages"
+            ).fetchone()
+            recent_ids: List[str] = [
+                row[0] for row in self._conn.execute(
+                    "SELECT email_id FROM processed_messages ORDER BY processed_at DESC LIMIT ?",
+                    (recent_limit,)
+                )
+            ]
+        return {
+            "total_processed": total,
+            "last_updated": last_updated or '',
+            "processed_ids": recent_ids
+        }
+
+    def clear(self):
+        """処理済みIDをすべて削除"""
+        with self._lock:
+            self._conn.execute("DELETE FROM processed_messages")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,46 @@
+from app.services.dify_service import DifyService
+from app.services.email_service import EmailService
+from app.services.imap_client import shutdown_imap_executor
+from app.services.imap_pool import get_imap_pool
+from app.services.notion_service import NotionService
+from app.services.ocr_cache import OcrCache
+from app.services.x_api_service import XApiService
+
+
+class ServiceRegistry:
+    """アプリケーション全体で共有するサービスのコンテナ
+
+    FastAPIの lifespan で1つだけ生成し、スケジューラーのジョブとAPIの両方から同じインスタンスを使う。
+    HTTPセッション・キャッシュ・IMAP接続はアプリケーションの停止時に aclose() でまとめて閉じる。
+    """
+
+    def __init__(self):
+        self.imap_pool = get_imap_pool()
+        self.email_service = EmailService()
+        self.x_api_service = XApiService()
+        self.dify_service = DifyService()
+        self.notion_service = NotionService()
+        self.ocr_cache = OcrCache()
+
+    async def aclose(self):
+        """すべてのサービスの接続・ファイルを閉じる（ひとつ失敗しても残りは閉じる）"""
+        closers = [
+            ("X-API", self.x_api_service.aclose),
+            ("Dify", self.dify_service.aclose),
+            ("Notion", self.notion_service.aclose),
+            ("メール", self.email_service.aclose),
+            ("OCRキャッシュ", self._close_sync(self.ocr_cache.close)),
+            ("IMAP", self._close_sync(self.imap_pool.close_all)),
+            ("IMAPスレッド", self._close_sync(shutdown_imap_executor)),
+        ]
+        for name, close in closers:
+            try:
+                await close()
+            except Exception as e:
+                print(f"{name}サービスの終了処理でエラーが発生しました: {e}")
+
+    @staticmethod
+    def _close_sync(func):
+        async def close():
+            func()
+        return close
@@ -0,0 +1,195 @@
+import json
+import threading
+import time
+from typing import Dict, Any, List, Optional
+
+from app.core import settings
+from app.core.database import connect_sqlite
+
+
+# 処理段階（後ろほど進んでいる）
+STAGES = ("stored", "uploaded", "ocr", "matched", "registered")
+
+_RESULT_COLUMNS = ("upload_result", "ocr_result", "fuzzy_search_result", "notion_result")
+
+
+class DocumentWorkQueue:
+    """保存済みPDFごとの外部API処理の進捗を記録する永続ワークキュー
+
+    - PDFを保存した時点で stored として登録し、アップロード・OCR・曖昧検索・Notion登録の完了ごとに結果を保存する
+    - ジョブが異常終了しても、次回は保存済みの結果を使って未完了の段階から再開する（OCRをやり直さない）
+    - stage は到達した最も先の段階（X-APIアップロードとOCRは並行して実行するため、再開時は各結果の有無で判断する）
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or f"{settings.STORAGE_PATH}/work_queue.db"
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(self.db_path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " pdf_file TEXT PRIMARY KEY,"
+            " email_id TEXT NOT NULL,"
+            " pdf_hash TEXT,"
+            " email_info TEXT NOT NULL,"
+            " stage TEXT NOT NULL,"
+            " upload_result TEXT,"
+            " ocr_result TEXT,"
+            " fuzzy_search_result TEXT,"
+            " notion_result TEXT,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " last_error TEXT,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL"
+            ")"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_documents_stage ON documents (stage, created_at)"
+        )
+
+    @staticmethod
+    def _row_to_dict(row) -> Dict[str, Any]:
+        (pdf_file, email_id, pdf_hash, email_info, stage, upload_result, ocr_result,
+         fuzzy_search_result, notion_result, attempts, last_error, created_at, updated_at) = row
+        return {
+            "pdf_file": pdf_file,
+            "email_id": email_id,
+            "pdf_hash": pdf_hash,
+            "email_info": json.loads(email_info),
+            "stage": stage,
+            "upload_result": json.loads(upload_result) if upload_result is not None else None,
+            "ocr_result": json.loads(ocr_result) if ocr_result is not None else None,
+            "fuzzy_search_result": json.loads(fuzzy_search_result) if fuzzy_search_result is not None else None,
+            "notion_result": json.loads(notion_result) if notion_result is not None else None,
+            "attempts": attempts,
+            "last_error": last_error,
+            "created_at": created_at,
+            "updated_at": updated_at
+        }
+
+    def enqueue(self, email_id: str, pdf_files: List[str], pdf_hashes: Dict[str, str], email_info: Dict[str, Any]):
+        """保存したPDFを stored として登録
+
+        処理途中のPDFが再取得された場合は進捗を引き継ぎ、登録済みまたは内容が変わったPDFは最初からやり直す
+        """
+        now = time.time()
+        info = json.dumps(email_info, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for pdf_file in pdf_files:
+                    pdf_hash = pdf_hashes.get(pdf_file)
+                    row = self._conn.execute(
+                        "SELECT stage, pdf_hash FROM documents WHERE pdf_file = ?", (pdf_file,)
+                    ).fetchone()
+                    if row is not None and row[0] != "registered" and row[1] == pdf_hash:
+                        self._conn.execute(
+                            "UPDATE documents SET email_id = ?, email_info = ?, updated_at = ? WHERE pdf_file = ?",
+                            (email_id, info, now, pdf_file)
+                        )
+                        continue
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO documents (pdf_file, email_id, pdf_hash, email_info, stage, created_at, updated_at)"
+                        " VALUES (?, ?, ?, ?, 'stored', ?, ?)",
+                        (pdf_file, email_id, pdf_hash, info, now, now)
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def get(self, pdf_file: str) -> Optional[Dict[str, Any]]:
+        """PDFの進捗を取得（登録されていなければNone）"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM documents WHERE pdf_file = ?", (pdf_file,)).fetchone()
+        return self._row_to_dict(row) if row is not None else None
+
+    def record(self, pdf_file: str, stage: str, **results: Any):
+        """段階の完了と結果を保存（stage は後退させない）"""
+        columns = [column for column in _RESULT_COLUMNS if column in results]
+        assignments = "".join(f", {column} = ?" for column in columns)
+        values = [json.dumps(results[column], ensure_ascii=False) for column in columns]
+        with self._lock:
+            row = self._conn.execute("SELECT stage FROM documents WHERE pdf_file = ?", (pdf_file,)).fetchone()
+            if row is None:
+                return
+            new_stage = stage if STAGES.index(stage) > STAGES.index(row[0]) else row[0]
+            self._conn.execute(
+                f"UPDATE documents SET stage = ?, last_error = NULL, updated_at = ?{assignments} WHERE pdf_file = ?",
+                (new_stage, time.time(), *values, pdf_file)
+            )
+
+    def record_failure(self, pdf_file: str, error: str):
+        """失敗を記録（WORK_QUEUE_MAX_ATTEMPTS 回に達するまでは、次回のジョブで未完了の段階から再試行される）"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE documents SET attempts = attempts + 1, last_error = ?, updated_at = ? WHERE pdf_file = ?",
+                (error, time.time(), pdf_file)
+            )
+            row = self._conn.execute("SELECT attempts FROM documents WHERE pdf_file = ?", (pdf_file,)).fetchone()
+        if row is not None and row[0] >= settings.WORK_QUEUE_MAX_ATTEMPTS:
+            print(f"{pdf_file} は{row[0]}回失敗したため再試行を停止します（最後のエラー: {error}）")
+
+    def remove(self, pdf_file: str):
+        """キューから削除"""
+        with self._lock:
+            self._conn.execute("DELETE FROM documents WHERE pdf_file = ?", (pdf_file,))
+
+    def pending_emails(self) -> List[Dict[str, Any]]:
+        """未完了で再試行回数が上限に達していないPDFを、メールごとにまとめて取得（ジョブの処理に渡すメールデータの形式）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM documents WHERE stage != 'registered' AND attempts < ? ORDER BY created_at, pdf_file",
+                (settings.WORK_QUEUE_MAX_ATTEMPTS,)
+            ).fetchall()
+        emails: Dict[str, Dict[str, Any]] = {}
+        for row in rows:
+            doc = self._row_to_dict(row)
+            email_data = emails.setdefault(doc["email_id"], {
+                "email_id": doc["email_id"],
+                "subject": doc["email_info"].get("subject", ""),
+                "from": doc["email_info"].get("from", ""),
+                "date": doc["email_info"].get("date", ""),
+                "pdf_files": [],
+                "pdf_hashes": {},
+                "email_info": doc["email_info"]
+            })
+            email_data["pdf_files"].append(doc["pdf_file"])
+            if doc["pdf_hash"]:
+                email_data["pdf_hashes"][doc["pdf_file"]] = doc["pdf_hash"]
+        return list(emails.values())
+
+    def purge_registered(self, max_age_days: int) -> int:
+        """登録済みになってから一定期間が過ぎた記録を削除"""
+        cutoff = time.time() - max_age_days * 24 * 60 * 60
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM documents WHERE stage = 'registered' AND updated_at < ?", (cutoff,)
+            )
+        return cursor.rowcount
+
+    def get_stats(self) -> Dict[str, Any]:
+        """段階ごとの件数、失敗中の件数、再試行を停止したPDFを取得"""
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT stage, COUNT(*) FROM documents GROUP BY stage").fetchall())
+            failing = self._conn.execute(
+                "SELECT COUNT(*) FROM documents WHERE stage != 'registered' AND last_error IS NOT NULL"
+            ).fetchone()[0]
+            exhausted = self._conn.execute(
+                "SELECT pdf_file, stage, attempts, last_error FROM documents"
+                " WHERE stage != 'registered' AND attempts >= ? ORDER BY updated_at DESC",
+                (settings.WORK_QUEUE_MAX_ATTEMPTS,)
+            ).fetchall()
+        return {
+            "stages": {stage: counts.get(stage, 0) for stage in STAGES},
+            "pending": sum(counts.get(stage, 0) for stage in STAGES[:-1]),
+            "failing": failing,
+            "max_attempts": settings.WORK_QUEUE_MAX_ATTEMPTS,
+            "exhausted": [
+                {"pdf_file": pdf_file, "stage": stage, "attempts": attempts, "last_error": last_error}
+                for pdf_file, stage, attempts, last_error in exhausted
+            ]
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
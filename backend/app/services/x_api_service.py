@@ -1,8 +1,11 @@
-import requests
+import asyncio
+import aiohttp
 from typing import Dict, Any, Optional
 from pathlib import Path
 import os
 from app.core import settings
+from app.core.http_client import ConnectionStats, create_client_session, is_transient_error, is_transient_status, is_unsent_error
+from app.core.resilience import CircuitOpenError, ResilientEndpoint, TransientHTTPError
 
 
 class XApiService:
@@ -11,6 +14,39 @@ class XApiService:
     def __init__(self):
         self.base_url = settings.X_API_URL
         self.api_key = settings.X_API_KEY
+        
+        # 接続を再利用するための共有セッション（初回リクエスト時にイベントループ上で作成）
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.connection_stats = ConnectionStats()
+        self.timeout = aiohttp.ClientTimeout(
+            total=settings.X_API_TIMEOUT_SECONDS,
+            connect=settings.X_API_CONNECT_TIMEOUT_SECONDS
+        )
+        # 一時的な障害の再試行と、停止中の即時失敗（アップロードは冪等でないため、未送信が確実な場合のみ再試行）
+        self.upload_endpoint = ResilientEndpoint("x_api.upload", is_transient_error, is_unsent_error)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = create_client_session(
+                self.connection_stats,
+                limit=settings.X_API_HTTP_POOL_LIMIT,
+                keepalive_seconds=settings.X_API_HTTP_KEEPALIVE_SECONDS,
+                dns_cache_seconds=settings.X_API_HTTP_DNS_CACHE_SECONDS
+            )
+        return self._session
+
+    async def aclose(self):
+        """共有セッションを閉じる"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    def get_connection_stats(self) -> Dict[str, Any]:
+        """接続の再利用状況を取得"""
+        return self.connection_stats.to_dict()
+
+    def get_circuit_breaker_stats(self) -> Dict[str, Any]:
+        """エンドポイントごとのサーキットブレーカーの状態を取得"""
+        return {"upload": self.upload_endpoint.get_stats()}
 
     async def upload_file(self, file_path: str, expire_hours: int = settings.X_API_EXPIRE_HOURS) -> Dict[str, Any]:
         """
@@ -21,7 +57,7 @@ class XApiService:
             expire_hours (int): ファイルの有効期限（時間）、デフォルト24時間
             
         Returns:
-            Dict[str, Any]: アップロード結果
+            Dict[str, Any]: アップロード結果（一時的な障害による失敗は "retryable": True を含む）
         """
         try:
             # ファイルの存在確認
@@ -31,54 +67,34 @@ class XApiService:
                     "message": f"ファイルが見つかりません: {file_path}"
                 }
             
-            # ヘッダー設定
-            headers = {
-                'Authorization': f'Bearer {self.api_key}'
+            return await self.upload_endpoint.call(self._post_file, file_path, expire_hours, idempotent=False)
+
+        # 以下の一時的な障害は retryable を付けて返す（呼び出し側は後で再試行する）
+        except CircuitOpenError as e:
+            return {
+                "status": "error",
+                "message": str(e),
+                "retryable": True
             }
-            
-            # ファイルとデータの準備
-            with open(file_path, 'rb') as file:
-                files = {
-                    'file': (os.path.basename(file_path), file, 'application/octet-stream')
-                }
-                data = {
-                    'expire_hours': expire_hours
-                }
-                
-                # API呼び出し
-                response = requests.post(
-                    self.base_url,
-                    files=files,
-                    data=data,
-                    headers=headers,
-                    timeout=30
-                )
-                
-                # レスポンス処理
-                if response.status_code == 200:
-                    result = response.json()
-                    return {
-                        "status": "success",
-                        "data": result,
-                        "message": "ファイルのアップロードが成功しました"
-                    }
-                else:
-                    return {
-                        "status": "error",
-                        "status_code": response.status_code,
-                        "message": f"アップロードに失敗しました: {response.text}",
-                        "response": response.text
-                    }
-                    
-        except requests.exceptions.Timeout:
+        except TransientHTTPError as e:
+            return {
+                "status": "error",
+                "status_code": e.status,
+                "message": f"アップロードに失敗しました: {e}",
+                "response": str(e),
+                "retryable": True
+            }
+        except asyncio.TimeoutError:
             return {
                 "status": "error",
-                "message": "リクエストがタイムアウトしました"
+                "message": "リクエストがタイムアウトしました",
+                "retryable": True
             }
-        except requests.exceptions.ConnectionError:
+        except aiohttp.ClientConnectionError:
             return {
                 "status": "error",
-                "message": "API接続エラーが発生しました"
+                "message": "API接続エラーが発生しました",
+                "retryable": True
             }
         except Exception as e:
             return {
@@ -86,6 +102,41 @@ class XApiService:
                 "message": f"予期しないエラーが発生しました: {str(e)}"
             }
     
+    async def _post_file(self, file_path: str, expire_hours: int) -> Dict[str, Any]:
+        """ファイルを1回送信（5xx・429は再試行の対象として TransientHTTPError を送出）"""
+        # ヘッダー設定
+        headers = {
+            'Authorization': f'Bearer {self.api_key}'
+        }
+
+        # ファイルとデータの準備
+        # ファイルオブジェクトを渡すと、aiohttpが固定サイズのチャンクで読み込みながら送信する（全体をメモリに載せない）
+        with open(file_path, 'rb') as file:
+            data = aiohttp.FormData()
+            data.add_field('file', file, filename=os.path.basename(file_path), content_type='application/octet-stream')
+            data.add_field('expire_hours', str(expire_hours))
+
+            # API呼び出し
+            async with self._get_session().post(self.base_url, data=data, headers=headers, timeout=self.timeout) as response:
+                # レスポンス処理
+                if response.status == 200:
+                    result = await response.json(content_type=None)
+                    return {
+                        "status": "success",
+                        "data": result,
+                        "message": "ファイルのアップロードが成功しました"
+                    }
+
+                response_text = await response.text()
+                if is_transient_status(response.status):
+                    raise TransientHTTPError(response.status, response_text)
+                return {
+                    "status": "error",
+                    "status_code": response.status,
+                    "message": f"アップロードに失敗しました: {response_text}",
+                    "response": response_text
+                }
+
     async def upload_pdf(self, pdf_file_path: str, expire_hours: int = 24) -> Dict[str, Any]:
         """
         PDFファイルをX-APIにアップロード（既存メソッドとの互換性維持）
@@ -1,5 +1,6 @@
 import os
 import shutil
+import sqlite3
 import json
 from datetime import datetime
 
@@ -15,12 +16,13 @@ def clear_storage():
     # 削除前の状態を記録
     deleted_files = {
         "json_files": [],
+        "db_files": [],
         "email_files": [],
         "pdf_files": []
     }
     
-    # 1. JSONファイルの削除（processed_email_ids.json, last_poll_time.json）
-    json_files = ["processed_email_ids.json", "last_poll_time.json"]
+    # 1. JSONファイルの削除（processed_email_ids.json, last_poll_time.json, imap_sync_state.json）
+    json_files = ["processed_email_ids.json", "last_poll_time.json", "imap_sync_state.json"]
     for json_file in json_files:
         json_path = f"{storage_path}/{json_file}"
         if os.path.exists(json_path):
@@ -34,6 +36,29 @@ def clear_storage():
             deleted_files["json_files"].append(json_file)
             print(f"JSONファイルを削除しました: {json_file}")
     
+    # 1-2. SQLiteファイルの削除（processed_messages.db, ocr_cache.db, work_queue.db, notion_clients.db）
+    db_files = ["processed_messages.db", "ocr_cache.db", "work_queue.db", "notion_clients.db"]
+    for db_file in db_files:
+        db_path = f"{storage_path}/{db_file}"
+        if os.path.exists(db_path):
+            # バックアップを作成（SQLiteのバックアップAPIで、WALに残っている未チェックポイントの更新も含めて複製）
+            backup_path = f"{db_path}.bak.{datetime.now().strftime('%Y%m%d%H%M%S')}"
+            source = sqlite3.connect(db_path)
+            backup = sqlite3.connect(backup_path)
+            try:
+                source.backup(backup)
+            finally:
+                backup.close()
+                source.close()
+            print(f"バックアップを作成しました: {backup_path}")
+            
+            # WAL・共有メモリファイルも合わせて削除
+            for suffix in ["", "-wal", "-shm"]:
+                if os.path.exists(f"{db_path}{suffix}"):
+                    os.remove(f"{db_path}{suffix}")
+            deleted_files["db_files"].append(db_file)
+            print(f"DBファイルを削除しました: {db_file}")
+    
     # 2. メールファイルの削除
     if os.path.exists(email_storage_path):
         email_files = os.listdir(email_storage_path)
@@ -59,9 +84,10 @@ def clear_storage():
         "timestamp": datetime.now().isoformat(),
         "deleted_files": {
             "json_files_count": len(deleted_files["json_files"]),
+            "db_files_count": len(deleted_files["db_files"]),
             "email_files_count": len(deleted_files["email_files"]),
             "pdf_files_count": len(deleted_files["pdf_files"]),
-            "total_count": len(deleted_files["json_files"]) + len(deleted_files["email_files"]) + len(deleted_files["pdf_files"])
+            "total_count": len(deleted_files["json_files"]) + len(deleted_files["db_files"]) + len(deleted_files["email_files"]) + len(deleted_files["pdf_files"])
         }
     }
     
@@ -71,6 +97,7 @@ def clear_storage():
     
     print("\n削除処理が完了しました")
     print(f"JSONファイル: {len(deleted_files['json_files'])}件")
+    print(f"DBファイル: {len(deleted_files['db_files'])}件")
     print(f"メールファイル: {len(deleted_files['email_files'])}件")
     print(f"PDFファイル: {len(deleted_files['pdf_files'])}件")
     print(f"合計: {summary['deleted_files']['total_count']}件")